@@ -0,0 +1,318 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from statsdbinterface import app_factory, function_cache, rankings
+from statsdbinterface.database import extmodels, models
+from statsdbinterface.database.core import db
+from statsdbinterface.querybudget import QueryCounter, view_budget
+
+import generate_stats
+
+
+def samples():
+    """
+    Return the most played handle, server and map and the latest game of
+    the handle.
+    """
+    def most_played(column):
+        return (db.session.query(column)
+                .filter(column != '').group_by(column)
+                .order_by(db.func.count().desc()).first()[0])
+
+    player = most_played(models.GamePlayer.handle)
+    return {
+        "player": player,
+        "server": most_played(models.GameServer.handle),
+        "map": most_played(models.Game.map),
+        "game": (db.session.query(db.func.max(models.GamePlayer.game_id))
+                 .filter(models.GamePlayer.handle == player).scalar()),
+        "mode": "ctf",
+        "mutator": "ffa",
+        "weapon": "rifle",
+    }
+
+
+def function_benchmarks(s, days):
+    """
+    Return (<name>, <function>) for the rankings, the extmodels entity
+    constructors and the Weapon.all_from_* calls.
+    """
+    recent = (models.Game.query.with_entities(models.Game.id)
+              .order_by(models.Game.id.desc()).limit(300))
+    player_games = (models.GamePlayer.query
+                    .with_entities(models.GamePlayer.game_id)
+                    .filter(models.GamePlayer.handle == s["player"])
+                    .order_by(models.GamePlayer.game_id.desc()).limit(50))
+    ret = [("rankings.first_game_in_days",
+            lambda: rankings.first_game_in_days(days)),
+           ("rankings.weapon_sums",
+            lambda: rankings.weapon_sums(rankings.last_days(days)))]
+    ret += [("rankings.%s" % name,
+             lambda f=f: f(rankings.last_days(days)))
+            for name, f in sorted(rankings.registry.items())]
+    ret += [
+        ("extmodels.Player", lambda: extmodels.Player(s["player"])),
+        ("extmodels.Server", lambda: extmodels.Server(s["server"])),
+        ("extmodels.Map", lambda: extmodels.Map(s["map"])),
+        ("extmodels.Mode", lambda: extmodels.Mode(s["mode"])),
+        ("extmodels.Mutator", lambda: extmodels.Mutator(s["mutator"])),
+        ("extmodels.Weapon.all", extmodels.Weapon.all),
+        ("extmodels.Weapon.all_from_games",
+         lambda: extmodels.Weapon.all_from_games(recent)),
+        ("extmodels.Weapon.all_from_f",
+         lambda: extmodels.Weapon.all_from_f((
+             models.GameWeapon.game_id >= rankings.first_game_in_days(days),
+             ))),
+        ("extmodels.Weapon.all_from_game",
+         lambda: extmodels.Weapon.all_from_game(s["game"])),
+        ("extmodels.Weapon.all_from_player_games",
+         lambda: extmodels.Weapon.all_from_player_games(s["player"],
+                                                        player_games)),
+    ]
+    return ret
+
+
+def route_urls(app, s):
+    """
+    Return a URL and the query budget for every route of the api and
+    displays blueprints.
+    """
+    adapter = app.url_map.bind('localhost')
+    ret = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        blueprint = rule.endpoint.rpartition('.')[0].rpartition('.')[2]
+        if blueprint not in ("api", "displays") or rule.endpoint.endswith(
+                ".static"):
+            continue
+        values = {}
+        for arg in rule.arguments:
+            if arg == "gameid":
+                values[arg] = s["game"]
+            elif "rankings" in rule.rule:
+                values[arg] = "players_by_dpm"
+            elif arg == "handle":
+                values[arg] = s["server" if "server" in rule.rule
+                                else "player"]
+            else:
+                values[arg] = s[next(
+                    (k for k in ["map", "mode", "mutator", "weapon"]
+                     if k in rule.rule), "weapon")]
+        url = adapter.build(rule.endpoint, values)
+        if url not in [u for u, b in ret]:
+            ret.append((url, view_budget(app, rule.endpoint)))
+    return ret
+
+
+# Page sizes, doubled to find the routes whose statements grow with them.
+PAGE_SIZES = [
+    "API_RESULTS_PER_PAGE",
+    "API_HIGHSCORE_RESULTS",
+    "DISPLAY_RESULTS_PER_PAGE",
+    "DISPLAY_RESULTS_RECENT",
+]
+
+
+def clear_caches():
+    with function_cache.cache_lock:
+        function_cache.cache.clear()
+    with extmodels.bundles_lock:
+        extmodels.bundles.clear()
+
+
+def measure(app, f, repeat):
+    """
+    Return the best wall time, the statements, SQL function calls and peak
+    memory of f, with the caches cleared before every run.
+    """
+    counter = QueryCounter()
+    times = []
+    for i in range(repeat):
+        clear_caches()
+        with app.test_request_context():
+            with counter:
+                start = time.perf_counter()
+                f()
+                times.append(time.perf_counter() - start)
+            db.session.remove()
+    clear_caches()
+    with app.test_request_context():
+        tracemalloc.start()
+        f()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        db.session.remove()
+    return {
+        "time": min(times),
+        "queries": counter.queries,
+        "udf_calls": counter.udf_calls,
+        "peak_memory": peak,
+    }
+
+
+def scaled_queries(app, f):
+    """
+    Return the statements of f with every page size doubled.
+    """
+    sizes = {key: app.config[key] for key in PAGE_SIZES}
+    app.config.update({key: size * 2 for key, size in sizes.items()})
+    try:
+        clear_caches()
+        with app.test_request_context():
+            with QueryCounter() as counter:
+                f()
+            db.session.remove()
+    finally:
+        app.config.update(sizes)
+    return counter.queries
+
+
+def run(data_dir, repeat, days, match):
+    app = app_factory.create_app(data_dir)
+    client = app.test_client()
+    with app.app_context():
+        s = samples()
+        games = models.Game.query.count()
+        benchmarks = function_benchmarks(s, days)
+
+    def get(url):
+        def f():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError("%s returned %d" % (
+                    url, response.status_code))
+        return f
+
+    benchmarks = [(name, f, None) for name, f in benchmarks]
+    benchmarks += [("route %s" % url, get(url), budget)
+                   for url, budget in route_urls(app, s)]
+
+    results = {}
+    for name, f, budget in benchmarks:
+        if match and not any(m in name for m in match):
+            continue
+        try:
+            with app.app_context():
+                results[name] = measure(app, f, repeat)
+                if name.startswith("route "):
+                    results[name]["scaled_queries"] = scaled_queries(app, f)
+            results[name]["budget"] = budget
+        except Exception as e:
+            results[name] = {"error": "%s: %s" % (type(e).__name__, e)}
+        print("%-60s %s" % (name, format_result(results[name])),
+              file=sys.stderr)
+    return {
+        "games": games,
+        "days": days,
+        "python": platform.python_version(),
+        "time": int(time.time()),
+        "results": results,
+    }
+
+
+def format_result(r):
+    if "error" in r:
+        return r["error"]
+    return "%9.2fms %6d queries %9d udf calls %9.1fKiB" % (
+        r["time"] * 1000, r["queries"], r["udf_calls"],
+        r["peak_memory"] / 1024)
+
+
+def over_budget(current):
+    """
+    Return the routes which executed more statements than their budget.
+    """
+    return [(name, "budget", r["budget"], r["queries"])
+            for name, r in sorted(current["results"].items())
+            if r.get("budget") is not None and r["queries"] > r["budget"]]
+
+
+def scaling(current):
+    """
+    Return the routes which executed more statements with doubled page sizes,
+    their budgets can't hold.
+    """
+    return [(name, "queries with doubled page sizes", r["queries"],
+             r["scaled_queries"])
+            for name, r in sorted(current["results"].items())
+            if r.get("scaled_queries", 0) > r.get("queries", 0)]
+
+
+def compare(baseline, current, threshold):
+    """
+    Return the regressions of current against baseline.
+    """
+    ret = []
+    for name, r in sorted(current["results"].items()):
+        b = baseline["results"].get(name)
+        if b is None or "error" in b:
+            continue
+        if "error" in r:
+            ret.append((name, "error", b.get("time"), r["error"]))
+            continue
+        for key in ["time", "peak_memory"]:
+            if r[key] > b[key] * (1 + threshold):
+                ret.append((name, key, b[key], r[key]))
+        for key in ["queries", "udf_calls"]:
+            if r[key] > b[key]:
+                ret.append((name, key, b[key], r[key]))
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the rankings, the entities and every route.")
+    parser.add_argument("data_dir",
+                        help="directory with stats.sqlite, generated with "
+                        "generate_stats.py if it doesn't exist")
+    parser.add_argument("--games", type=int, default=10000,
+                        help="games to generate if there is no database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=30,
+                        help="time span passed to the rankings")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per benchmark, the fastest one counts")
+    parser.add_argument("--match", action="append",
+                        help="only run benchmarks containing this")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="flag regressions against this results file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative increase of time and memory")
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir)
+    path = os.path.join(data_dir, "stats.sqlite")
+    if not os.path.exists(path):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        print("Generating %d games in %s" % (args.games, path),
+              file=sys.stderr)
+        generate_stats.generate(path, args.games, 500, 20,
+                                len(generate_stats.MAPS), 365, args.seed,
+                                int(time.time()))
+
+    current = run(data_dir, max(args.repeat, 1), args.days, args.match)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+    regressions = over_budget(current) + scaling(current)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions += compare(baseline, current, args.threshold)
+    for name, key, old, new in regressions:
+        print("REGRESSION %s %s: %s -> %s" % (name, key, old, new),
+              file=sys.stderr)
+    if regressions:
+        sys.exit(1)
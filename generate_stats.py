@@ -0,0 +1,287 @@
+#! /usr/bin/env python3
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from statsdbinterface.redeclipse import versions
+
+
+SCHEMA = """
+CREATE TABLE games (
+    id INTEGER PRIMARY KEY, time INTEGER, map TEXT, mode INTEGER,
+    mutators INTEGER, timeplayed INTEGER, uniqueplayers INTEGER,
+    usetotals INTEGER);
+CREATE TABLE game_servers (
+    game INTEGER, handle TEXT, flags TEXT, desc TEXT, version TEXT,
+    host TEXT, port INTEGER);
+CREATE TABLE game_teams (
+    game INTEGER, team INTEGER, score INTEGER, name TEXT);
+CREATE TABLE game_players (
+    game INTEGER, name TEXT, handle TEXT, score INTEGER, timealive INTEGER,
+    frags INTEGER, deaths INTEGER, wid INTEGER, timeactive INTEGER);
+CREATE TABLE game_weapons (
+    game INTEGER, player INTEGER, playerhandle TEXT, weapon TEXT,
+    timewielded INTEGER, timeloadout INTEGER,
+    damage1 INTEGER, frags1 INTEGER, hits1 INTEGER, flakhits1 INTEGER,
+    shots1 INTEGER, flakshots1 INTEGER,
+    damage2 INTEGER, frags2 INTEGER, hits2 INTEGER, flakhits2 INTEGER,
+    shots2 INTEGER, flakshots2 INTEGER);
+CREATE TABLE game_captures (
+    game INTEGER, player INTEGER, playerhandle TEXT,
+    capturing INTEGER, captured INTEGER);
+CREATE TABLE game_bombings (
+    game INTEGER, player INTEGER, playerhandle TEXT,
+    bombing INTEGER, bombed INTEGER);
+CREATE TABLE game_ffarounds (
+    game INTEGER, player INTEGER, playerhandle TEXT,
+    round INTEGER, winner INTEGER);
+"""
+
+INDEXES = """
+CREATE INDEX game_servers_game ON game_servers (game);
+CREATE INDEX game_teams_game ON game_teams (game);
+CREATE INDEX game_players_game ON game_players (game);
+CREATE INDEX game_players_handle ON game_players (handle);
+CREATE INDEX game_weapons_game ON game_weapons (game);
+CREATE INDEX game_weapons_playerhandle ON game_weapons (playerhandle);
+CREATE INDEX game_captures_game ON game_captures (game);
+CREATE INDEX game_bombings_game ON game_bombings (game);
+CREATE INDEX game_ffarounds_game ON game_ffarounds (game);
+"""
+
+RE = versions.default
+
+# <mode>: <relative frequency>
+MODES = {"dm": 35, "ctf": 25, "race": 20, "bb": 10, "dac": 10}
+
+# <mutator>: <chance of being set>, gamespecific ones only for their mode.
+MUTATORS = {
+    "ffa": 0.45, "insta": 0.2, "medieval": 0.04, "kaboom": 0.03,
+    "duel": 0.05, "survivor": 0.05, "classic": 0.05, "onslaught": 0.02,
+    "vampire": 0.03, "resize": 0.02, "hard": 0.02, "basic": 0.02,
+    "multi": 0.02, "coop": 0.01, "freestyle": 0.05,
+    "quick": 0.2, "defend": 0.1, "protect": 0.05, "king": 0.1,
+    "hold": 0.15, "basket": 0.1, "attack": 0.1,
+    "timed": 0.85, "endurance": 0.2, "gauntlet": 0.05,
+    "gladiator": 0.05, "oldschool": 0.05,
+}
+
+MAPS = [
+    "bath", "cargo", "center", "darkness", "deadsimple", "deathtrap",
+    "dutility", "echo", "error", "foundation", "futuresport", "ghost",
+    "hinder", "linear", "mist", "octavus", "oneiroi", "outpost", "processing",
+    "relay", "spacetech", "suspended", "teller", "testchamber", "tranquility",
+    "tribal", "ubik", "wet", "wishbone",
+]
+
+VERSIONS = ["1.5.4", "1.5.5", "1.5.6"]
+
+
+def zipf_weights(n, s=1.1):
+    """
+    Return cumulative weights so few items are very popular and most are
+    rare.
+    """
+    return list(itertools.accumulate(1 / (i + 1) ** s for i in range(n)))
+
+
+class Generator:
+    def __init__(self, db, handles, servers, maps, rnd):
+        self.db = db
+        self.rnd = rnd
+        self.handles = ["player%d" % i for i in range(handles)]
+        self.handle_weights = zipf_weights(handles)
+        self.servers = [("server%d" % i, "Server %d" % i,
+                         "10.0.%d.%d" % (i // 250, i % 250 + 1),
+                         28801 + i % 4 * 10, rnd.choice(VERSIONS))
+                        for i in range(servers)]
+        self.server_weights = zipf_weights(servers, 0.8)
+        self.maps = (MAPS * (maps // len(MAPS) + 1))[:maps]
+        self.maps = [m if i < len(MAPS) else "%s%d" % (m, i // len(MAPS))
+                     for i, m in enumerate(self.maps)]
+        self.map_weights = zipf_weights(maps, 0.7)
+        self.rows = {table: [] for table in [
+            "games", "game_servers", "game_teams", "game_players",
+            "game_weapons", "game_captures", "game_bombings",
+            "game_ffarounds"]}
+
+    def mutators(self, mode):
+        modei = RE.modes[mode]
+        mutators = 0
+        for mut, bit in RE.muttables[modei]:
+            if self.rnd.random() < MUTATORS.get(mut, 0):
+                mutators |= bit
+        # Teams need more than one side, race is mostly played alone.
+        if mode in ("ctf", "bb"):
+            mutators &= ~RE.basemuts["ffa"]
+        if mode == "race":
+            mutators |= RE.basemuts["ffa"]
+        return mutators
+
+    def weapons(self, muts):
+        if "insta" in muts:
+            return ["rifle", "melee"]
+        if "medieval" in muts:
+            return ["sword", "melee"]
+        if "kaboom" in muts:
+            return ["grenade", "mine", "rocket", "melee"]
+        return (["claw", "pistol"] +
+                self.rnd.sample(RE.loadoutweaponlist, 2) +
+                ["grenade", "mine", "melee"])
+
+    def game(self, game_id, when):
+        rnd = self.rnd
+        rows = self.rows
+        mode = rnd.choices(list(MODES), list(MODES.values()))[0]
+        modei = RE.modes[mode]
+        mutators = self.mutators(mode)
+        muts = RE.mutslist(modei, mutators)
+        timed = mode == "race" and "timed" in muts
+        timeplayed = rnd.randint(120, 900)
+        numplayers = (1 if timed and rnd.random() < 0.4 else
+                      min(2 + int(rnd.expovariate(0.3)), 16))
+        handles = set()
+        players = []
+        for wid in range(numplayers):
+            handle = ""
+            if rnd.random() < 0.7:
+                handle = rnd.choices(self.handles,
+                                     cum_weights=self.handle_weights)[0]
+                if handle in handles:
+                    handle = ""
+                handles.add(handle)
+            players.append((wid, handle,
+                            handle or "unnamed%d" % rnd.randint(1, 999)))
+
+        map_ = rnd.choices(self.maps, cum_weights=self.map_weights)[0]
+        rows["games"].append((
+            game_id, when, map_, modei, mutators, timeplayed, len(players),
+            1))
+        handle, desc, host, port, version = rnd.choices(
+            self.servers, cum_weights=self.server_weights)[0]
+        rows["game_servers"].append(
+            (game_id, handle, "", desc, version, host, port))
+
+        teams = []
+        if "ffa" not in muts:
+            teams = [1, 2]
+            for team in teams:
+                rows["game_teams"].append((
+                    game_id, team, rnd.randint(0, 10),
+                    ["alpha", "omega"][team - 1]))
+
+        weapons = self.weapons(muts)
+        for wid, handle, name in players:
+            timeactive = rnd.randint(timeplayed // 3, timeplayed)
+            timealive = int(timeactive * rnd.uniform(0.6, 0.95))
+            frags = 0 if mode == "race" else int(rnd.gammavariate(2, 4))
+            deaths = 0 if mode == "race" else int(rnd.gammavariate(2, 4))
+            if timed:
+                # Race times in milliseconds, 0 if the race wasn't finished.
+                score = (0 if rnd.random() < 0.2 else
+                         int(rnd.lognormvariate(11, 0.4)))
+            else:
+                score = frags + rnd.randint(0, 5)
+            rows["game_players"].append((
+                game_id, name, handle, score, timealive, frags, deaths, wid,
+                timeactive))
+            if mode == "race":
+                continue
+            share = [rnd.random() for w in weapons]
+            for weapon, part in zip(weapons, share):
+                wielded = int(timealive * part / sum(share))
+                hits = rnd.randint(0, wielded // 2 + 1)
+                rows["game_weapons"].append((
+                    game_id, wid, handle, weapon, wielded,
+                    timealive if weapon in RE.notwielded else wielded,
+                    hits * rnd.randint(10, 60), int(frags * part / sum(share)),
+                    hits, 0,
+                    hits + rnd.randint(0, hits + 5), 0,
+                    hits * rnd.randint(0, 20), 0, hits // 3, 0,
+                    hits // 2, 0))
+            if mode == "ctf" and teams:
+                for n in range(rnd.randint(0, 2)):
+                    rows["game_captures"].append(
+                        (game_id, wid, handle, 1, 2))
+            if mode == "bb" and teams:
+                for n in range(rnd.randint(0, 2)):
+                    rows["game_bombings"].append(
+                        (game_id, wid, handle, 1, 2))
+
+        if "ffa" in muts and "survivor" in muts and len(players) > 1:
+            for round_ in range(1, rnd.randint(2, 6)):
+                winner = rnd.choice(players)[0]
+                for wid, handle, name in players:
+                    rows["game_ffarounds"].append(
+                        (game_id, wid, handle, round_, wid == winner))
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                self.db.executemany("INSERT INTO %s VALUES (%s)" % (
+                    table, ", ".join("?" * len(rows[0]))), rows)
+                del rows[:]
+        self.db.commit()
+
+
+def generate(path, games, handles, servers, maps, days, seed, end,
+             indexes=False):
+    """
+    Write a stats.sqlite with games spread over the days before end to path.
+    """
+    if os.path.exists(path):
+        raise RuntimeError("%s already exists" % path)
+    rnd = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    generator = Generator(db, handles, servers, maps, rnd)
+    start = end - days * 24 * 60 * 60
+    times = []
+    while len(times) < games:
+        when = rnd.randint(start, end)
+        # Three times as many games in the evening (UTC) than otherwise.
+        if 16 <= when // 3600 % 24 <= 23 or rnd.random() < 1 / 3:
+            times.append(when)
+    times.sort()
+    for game_id, when in enumerate(times, 1):
+        generator.game(game_id, when)
+        if game_id % 1000 == 0:
+            generator.flush()
+    generator.flush()
+    if indexes:
+        db.executescript(INDEXES)
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic stats.sqlite for testing.")
+    parser.add_argument("data_dir",
+                        help="directory to create stats.sqlite in")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--handles", type=int, default=500)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--maps", type=int, default=len(MAPS))
+    parser.add_argument("--days", type=int, default=365,
+                        help="time span of the games")
+    parser.add_argument("--end", type=int, default=int(time.time()),
+                        help="time of the last game, defaults to now")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--indexes", action="store_true",
+                        help="also index the game and handle columns")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        os.makedirs(args.data_dir)
+    try:
+        generate(os.path.join(args.data_dir, "stats.sqlite"), args.games,
+                 args.handles, args.servers, args.maps, args.days,
+                 args.seed, args.end, args.indexes)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
@@ -3,11 +3,10 @@
 import os
 import sys
 
-from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 
-from statsdbinterface import app_factory
+from statsdbinterface import app_factory, stream
 
 
 def create_app(data_dir):
@@ -41,7 +40,8 @@ if __name__ == "__main__":
         # Use Flask's debugging server.
         app.run(host=app.config['HOST'], port=app.config['PORT'], debug=True)
     else:
-        # Use Tornado's HTTPServer.
-        http_server = HTTPServer(WSGIContainer(app))
+        # Use Tornado's HTTPServer, which also serves /api/stream/games.
+        http_server = HTTPServer(stream.application(app))
         http_server.listen(address=app.config['HOST'], port=app.config['PORT'])
+        stream.start_polling(app)
         IOLoop.instance().start()
@@ -18,4 +18,7 @@ setup(
         "Flask-SQLAlchemy>=2.0",
         "tornado>=4.4.0",
     ],
+    extras_require={
+        "fastjson": ["orjson"],
+    },
 )
@@ -0,0 +1,59 @@
+import time
+from .database import models
+from .database.core import db
+from .function_cache import cached
+from . import postings
+
+weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# <bucket of local time t>, <period the window is aligned to>, <label>
+# The epoch began on a Thursday, so day 0 is weekday 3.
+buckets = {
+    "hours": (
+        lambda t: (t / 3600) % 24,
+        60 * 60,
+        lambda b: "%d" % b),
+    "weekdays": (
+        lambda t: (t / 86400 + 3) % 7,
+        60 * 60 * 24,
+        lambda b: weekdays[b]),
+    "weekdayhours": (
+        lambda t: (t / 86400 + 3) % 7 * 24 + (t / 3600) % 24,
+        60 * 60 * 24,
+        lambda b: "%s %d" % (weekdays[b // 24], b % 24)),
+}
+
+
+def window_end(kind, utcoffset):
+    """
+    Return the start of the current hour or day in local time.
+    """
+    period = buckets[kind][1]
+    return int((time.time() + utcoffset) // period * period - utcoffset)
+
+
+@cached(60 * 60)
+def histogram(kind, days, utcoffset, end):
+    """
+    Return a sorted list of buckets and their game counts over the
+    days before end, with times shifted by utcoffset seconds.
+    The bucketing is done by the database, only the counts are fetched.
+    """
+    bucket, period, label = buckets[kind]
+    start = end - days * 60 * 60 * 24
+    first_game, last_game = postings.window(start, end - 1)
+    column = bucket(models.Game.time + utcoffset).label("bucket")
+    counts = dict(models.Game.query
+                  .with_entities(column, db.func.count(models.Game.id))
+                  .filter(models.Game.id >= first_game)
+                  .filter(models.Game.id <= last_game)
+                  .filter(models.Game.time >= start)
+                  .filter(models.Game.time < end)
+                  .group_by(column).all())
+    barfactor = 100 / max(list(counts.values()) + [1])
+    return [{
+        "bucket": b,
+        "label": label(b),
+        "players": counts[b],
+        "bar": "|" * round(counts[b] * barfactor),
+        } for b in sorted(counts)]
@@ -30,11 +30,51 @@ def create_app(data_dir):
     # Load the database.
     setup_db(app)
 
+    # Pass new games to the indexes as they arrive. This must precede the
+    # hooks below, which would count the statements of indexing them
+    # against the request.
+    from . import indexes
+    app.before_request(indexes.update)
+
+    # Record request metrics and serve them on /metrics.
+    if app.config['METRICS']:
+        from . import metrics
+        metrics.setup(app)
+
+    # Profile the SQL statements of each request.
+    if app.config['SQL_PROFILE']:
+        from . import sqlprofile
+        sqlprofile.setup(app)
+
+    # Profile slow requests and those requested by admins.
+    if (app.config['PROFILE_SLOW_REQUESTS'] is not None or
+            app.config['PROFILE_ADMINS']):
+        from . import slowprofile
+        slowprofile.setup(app, data_dir)
+
+    # Enforce the query budgets of the views.
+    if app.config['QUERY_BUDGETS']:
+        from . import querybudget
+        querybudget.setup(app)
+
+    # Encode the API responses with the fastest JSON library installed.
+    from . import fastjson
+    fastjson.setup(app)
+
     # Register views
     from .views import api, displays
     app.register_blueprint(api.bp)
     app.register_blueprint(displays.bp)
 
+    # Keep the latest games for /api/stream/games, served by run.py.
+    from . import stream
+    stream.setup(app)
+
+    # Build the indexes, resuming from the on-disk snapshot if enabled.
+    # This must follow the views, which import the rest of the indexes.
+    from . import snapshot
+    snapshot.setup(app, data_dir)
+
     # set up error handling
     from .error_handling import setup_app
     setup_app(app)
@@ -0,0 +1,81 @@
+from . import indexes
+
+# All-time totals of each player handle.
+# <handle>: {"games": <games>, "first": <game id>, "last": <game id>,
+#            "frags": ..., "deaths": ..., "timealive": ...,
+#            "timeactive": ..., "weapons": {<weapon>: [<column sums>]}}
+# The weapon sums are in the order of extmodels.Weapon.columns.
+careers = {}
+
+
+def career(handle):
+    """
+    Return the totals of handle, or None if handle never played.
+    """
+    return careers.get(handle)
+
+
+def new_career():
+    return {
+        "games": 0,
+        "first": None,
+        "last": None,
+        "frags": 0,
+        "deaths": 0,
+        "timealive": 0,
+        "timeactive": 0,
+        "weapons": {},
+    }
+
+
+def load_careers(state):
+    careers.clear()
+    careers.update(state)
+
+
+@indexes.index('careers', lambda: careers, load_careers)
+def build_careers(first, last):
+    """
+    Add the players and weapons of games first to last to the totals.
+    """
+    from .database.core import db
+    from .database.extmodels import Weapon
+    from .database.models import GamePlayer, GameWeapon
+    # Read everything before changing the totals.
+    players = (GamePlayer.query.with_entities(
+                   GamePlayer.handle,
+                   db.func.count(db.distinct(GamePlayer.game_id)),
+                   db.func.min(GamePlayer.game_id),
+                   db.func.max(GamePlayer.game_id),
+                   db.func.sum(GamePlayer.frags),
+                   db.func.sum(GamePlayer.deaths),
+                   db.func.sum(GamePlayer.timealive),
+                   db.func.sum(GamePlayer.timeactive))
+               .filter(GamePlayer.game_id >= first,
+                       GamePlayer.game_id <= last)
+               .filter(GamePlayer.handle != '')
+               .group_by(GamePlayer.handle).all())
+    weapons = (GameWeapon.query.with_entities(
+                   GameWeapon.playerhandle, GameWeapon.weapon,
+                   *[db.func.sum(getattr(GameWeapon, c))
+                     for c in Weapon.columns])
+               .filter(GameWeapon.game_id >= first,
+                       GameWeapon.game_id <= last)
+               .filter(GameWeapon.playerhandle != '')
+               .group_by(GameWeapon.playerhandle, GameWeapon.weapon).all())
+    for handle, games, first_game, last_game, frags, deaths, timealive, \
+            timeactive in players:
+        c = careers.setdefault(handle, new_career())
+        c["games"] += games
+        if c["first"] is None:
+            c["first"] = first_game
+        c["last"] = last_game
+        c["frags"] += frags or 0
+        c["deaths"] += deaths or 0
+        c["timealive"] += timealive or 0
+        c["timeactive"] += timeactive or 0
+    for r in weapons:
+        handle, weapon, sums = r[0], r[1], r[2:]
+        totals = careers.setdefault(handle, new_career())["weapons"]
+        old = totals.get(weapon, [0] * len(sums))
+        totals[weapon] = [a + (b or 0) for a, b in zip(old, sums)]
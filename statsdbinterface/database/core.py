@@ -4,6 +4,8 @@ import traceback
 
 
 db_functions = []
+# Number of calls of each db_function, by name.
+db_function_calls = {}
 
 
 def db_function(name):
@@ -12,7 +14,10 @@ def db_function(name):
     """
 
     def d(f):
+        db_function_calls[name] = 0
+
         def w(*args, **kwargs):
+            db_function_calls[name] += 1
             try:
                 return f(*args, **kwargs)
             except:
@@ -43,10 +48,6 @@ def setup_db(app):
             for f in db_functions:
                 conn.connection.create_function(f[0], f[1], f[2])
 
-    # Register models, functions and views.
+    # Register models, functions, indexes and views.
     from .. import redeclipse, views  # noqa
     from . import models  # noqa
-
-    with app.app_context():
-        redeclipse.functions.build_precache()
-        redeclipse.versions.build_precache()
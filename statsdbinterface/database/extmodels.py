@@ -1,34 +1,70 @@
+from collections import OrderedDict
+from threading import Lock
 from flask import current_app
 from werkzeug.exceptions import NotFound
 from .core import db
-from .models import Game, GamePlayer, GameServer, GameWeapon
+from .models import (Game, GameBombing, GameCapture, GameFFARound,
+                     GamePlayer, GameServer, GameTeam, GameWeapon)
 from .modelutils import direct_to_dict, to_pagination
-from .. import redeclipse
-from .. function_cache import cached
+from .. import careers, fastjson, leaderboards, postings, redeclipse
+from .. function_cache import cached, per_request
+
+# Recently used GameBundles, least recently used first.
+# <game id>: <GameBundle>
+bundles = OrderedDict()
+bundles_lock = Lock()
+
+
+def select(d, keys):
+    # Return the items of d with <keys>, all of them if <keys> is None.
+    if keys is None:
+        return d
+    return {k: v for k, v in d.items() if k in keys}
+
+
+def games_by_id(ids, newest_first=False):
+    # Return the GameBundles of the games with ids, with their players and
+    # servers, ordered by id.
+    games = GameBundle.get_many(list(ids), [GamePlayer, GameServer])
+    return [games[gameid] for gameid in sorted(games, reverse=newest_first)]
+
+
+def page_ids(ids, page, pagesize, newest_first=False):
+    # Return page <page> of ids, counting from the end if newest_first.
+    if pagesize is None:
+        return ids
+    if newest_first:
+        end = len(ids) - page * pagesize
+        return ids[max(0, end - pagesize):max(0, end)]
+    return ids[page * pagesize:page * pagesize + pagesize]
+
+
+def entity_games(entity, page, pagesize, newest_first):
+    # Return page <page> of entity's games.
+    return games_by_id(page_ids(entity.game_ids, page, pagesize,
+                                newest_first), newest_first)
 
 
 class Player:
+    # The career totals in to_dict, the weapons are in weapons().
+    career_fields = ["games", "first", "last", "frags", "deaths",
+                     "timealive", "timeactive"]
+
     @staticmethod
     def handle_list():
         # Return a list of all player handles in the database.
-        ret = [r[0] for r in
-               GamePlayer.query.with_entities(GamePlayer.handle).filter(
-               GamePlayer.handle != '')
-               .group_by(GamePlayer.handle)
-               .order_by(GamePlayer.game_id.desc()).all()]
-        return ret
+        return postings.keys('player')
 
     @staticmethod
     def count():
         # Return the number of handles in the database.
-        return GamePlayer.query.filter(
-            GamePlayer.handle != '').group_by(GamePlayer.handle).count()
+        return len(Player.handle_list())
 
     @staticmethod
+    @per_request
     def get_or_404(handle):
         # Return a Player for <handle> if <handle> exists, otherwise 404.
-        handles = Player.handle_list()
-        if handle in handles:
+        if postings.game_ids('player', handle):
             return Player(handle)
         else:
             raise NotFound
@@ -41,44 +77,60 @@ class Player:
         if pagesize is not None:
             filtered_handles = handles[
                 page * pagesize:page * pagesize + pagesize]
-        return [Player(handle) for handle in filtered_handles]
+        return Player.many(filtered_handles)
+
+    @staticmethod
+    def many(handles):
+        # Return Players for <handles>, loading the GamePlayers of their
+        # first and latest games, with the games, in one query.
+        ends = {handle: postings.game_ids('player', handle)
+                for handle in handles}
+        gameids = {ids[i] for ids in ends.values() for i in (0, -1)}
+        rows = {}
+        if handles:
+            for row in (GamePlayer.query
+                        .options(db.joinedload(GamePlayer.game))
+                        .filter(GamePlayer.game_id.in_(gameids))
+                        .filter(GamePlayer.handle.in_(handles))
+                        .order_by(GamePlayer.game_id, GamePlayer.wid)):
+                rows.setdefault((row.game_id, row.handle), row)
+        return [Player(handle, rows[(ends[handle][0], handle)],
+                       rows[(ends[handle][-1], handle)])
+                for handle in handles]
 
     @classmethod
     def paginate(cls, page, per_page):
         return to_pagination(page, per_page, cls.all, cls.count)
 
-    def __init__(self, handle):
-        # Build a Player object from the database.
+    def __init__(self, handle, first=None, latest=None):
+        # Build a Player object from the database, unless the GamePlayers of
+        # its <first> and <latest> games are given.
         self.handle = handle
-        all_games = [r[0] for r in Game.query.with_entities(Game.id).all()]
-        self.game_ids = [r[0] for r in GamePlayer.query.with_entities(
-            GamePlayer.game_id).filter(GamePlayer.handle == self.handle).all()
-            if r[0] in all_games]
-        self.latest = GamePlayer.query.filter(
+        self.game_ids = postings.game_ids('player', self.handle)
+        # Changes whenever the player plays, for caching.
+        self.cache_key = (self.handle, self.game_ids[-1])
+        self.latest = latest or GamePlayer.query.filter(
             GamePlayer.game_id == self.game_ids[-1],
             GamePlayer.handle == self.handle).first()
-        self.first = GamePlayer.query.filter(
+        self.first = first or GamePlayer.query.filter(
             GamePlayer.game_id == self.game_ids[0],
             GamePlayer.handle == self.handle).first()
 
-    def games(self, page=0, pagesize=None):
-        # Return full Game objects from Player's game_ids.
-        ids = (self.game_ids[page * pagesize:page * pagesize + pagesize]
-               if pagesize is not None else self.game_ids)
-        if not ids:
-            return []
-        return Game.query.filter(Game.id.in_(ids)).all()
+    def games(self, page, pagesize, newest_first=False):
+        # Return the GameBundles of Player's game_ids.
+        return entity_games(self, page, pagesize, newest_first)
+
+    def games_count(self):
+        # Return the number of games, without loading them.
+        return len(self.game_ids)
 
     def recent_games(self, number):
-        ids = reversed(self.game_ids[-number:])
-        if not ids:
-            return []
-        return Game.query.filter(
-            Game.id.in_(ids)).order_by(Game.id.desc()).all()
+        return self.games(0, number, True)
 
-    def games_paginate(self, page, per_page):
-        return to_pagination(page, per_page, self.games,
-                             lambda: len(self.game_ids))
+    def games_paginate(self, page, per_page, newest_first=False):
+        return to_pagination(page, per_page,
+                             lambda a, b: self.games(a, b, newest_first),
+                             self.games_count)
 
     def game_player(self, game_id):
         return GamePlayer.query.filter(
@@ -89,92 +141,97 @@ class Player:
         if number == 0:
             return list(reversed(self.game_ids))
         else:
-            return list(reversed(self.game_ids))[:number]
+            return list(reversed(self.game_ids[-number:]))
+
+    @cached(24 * 60 * 60, 'cache_key')
+    def summary(self, window):
+        """
+        Return the DPM, FPM, KDR and DFR over the last <window> games, all if
+        0, and the maps of all games by the number of games played.
+        Cached until the player plays another game.
+        """
+        # The window is every game of the player from this one on.
+        start = (self.game_ids[-window]
+                 if 0 < window <= len(self.game_ids) else 0)
+
+        def windowed(column, game_id):
+            return db.func.sum(db.case([(
+                game_id >= start,
+                column * db.func.re_normal_weapons(game_id))], else_=0))
+
+        maps = {}
+        time = frags = deaths = 0
+        for map_, games, t, f, d in (
+                GamePlayer.query.join(Game).with_entities(
+                    Game.map, db.func.count(db.distinct(GamePlayer.game_id)),
+                    windowed(GamePlayer.timealive, GamePlayer.game_id),
+                    windowed(GamePlayer.frags, GamePlayer.game_id),
+                    windowed(GamePlayer.deaths, GamePlayer.game_id))
+                .filter(GamePlayer.handle == self.handle)
+                .group_by(Game.map)):
+            maps[map_] = games
+            time += t or 0
+            frags += f or 0
+            deaths += d or 0
+        damage = GameWeapon.query.with_entities(
+            db.func.sum(GameWeapon.damage1 + GameWeapon.damage2)).filter(
+                GameWeapon.playerhandle == self.handle,
+                GameWeapon.game_id >= start,
+                db.func.re_normal_weapons(GameWeapon.game_id)
+                ).first()[0] or 0
+        return {
+            "dpm": damage / (max(1, time) / 60),
+            "fpm": frags / (max(1, time) / 60),
+            "kdr": frags / max(1, deaths),
+            "dfr": damage / max(1, frags),
+            "topmaps": [{"name": m, "games": maps[m]}
+                        for m in sorted(sorted(maps),
+                                        key=lambda m: maps[m], reverse=True)],
+        }
 
-    @cached(5 * 60, 'handle')
     def dpm(self, games_ago):
-        games = self.last_games(games_ago)
-        d1, d2 = GameWeapon.query.with_entities(
-            db.func.sum(GameWeapon.damage1),
-            db.func.sum(GameWeapon.damage2)).filter(
-                GameWeapon.game_id.in_(games),
-                db.func.re_normal_weapons(GameWeapon.game_id),
-                GameWeapon.playerhandle == self.handle
-                ).first()
-        time = GamePlayer.query.with_entities(
-            db.func.sum(GamePlayer.timealive)).filter(
-                GamePlayer.game_id.in_(games),
-                db.func.re_normal_weapons(GamePlayer.game_id),
-                GamePlayer.handle == self.handle
-                ).first()[0]
-        return ((d1 or 0) + (d2 or 0)) / (max(1, (time or 0)) / 60)
+        return self.summary(games_ago)["dpm"]
 
-    @cached(5 * 60, 'handle')
     def fpm(self, games_ago):
-        games = self.last_games(games_ago)
-        time, frags = GamePlayer.query.with_entities(
-            db.func.sum(GamePlayer.timealive),
-            db.func.sum(GamePlayer.frags)).filter(
-                GamePlayer.game_id.in_(games),
-                db.func.re_normal_weapons(GamePlayer.game_id),
-                GamePlayer.handle == self.handle
-                ).first()
-        return (frags or 0) / (max(1, (time or 0)) / 60)
+        return self.summary(games_ago)["fpm"]
 
-    @cached(5 * 60, 'handle')
     def kdr(self, games_ago):
-        games = self.last_games(games_ago)
-        frags, deaths = GamePlayer.query.with_entities(
-            db.func.sum(GamePlayer.frags),
-            db.func.sum(GamePlayer.deaths)).filter(
-                GamePlayer.game_id.in_(games),
-                db.func.re_normal_weapons(GamePlayer.game_id),
-                GamePlayer.handle == self.handle
-                ).first()
-        return (frags or 0) / max(1, deaths or 0)
+        return self.summary(games_ago)["kdr"]
 
-    @cached(5 * 60, 'handle')
     def dfr(self, games_ago):
-        games = self.last_games(games_ago)
-        d1, d2 = GameWeapon.query.with_entities(
-            db.func.sum(GameWeapon.damage1),
-            db.func.sum(GameWeapon.damage2)).filter(
-                GameWeapon.game_id.in_(games),
-                db.func.re_normal_weapons(GameWeapon.game_id),
-                GameWeapon.playerhandle == self.handle
-                ).first()
-        frags = GamePlayer.query.with_entities(
-            db.func.sum(GamePlayer.frags)).filter(
-                GamePlayer.game_id.in_(games),
-                db.func.re_normal_weapons(GamePlayer.game_id),
-                GamePlayer.handle == self.handle
-                ).first()[0]
-        return ((d1 or 0) + (d2 or 0)) / max(1, frags or 0)
+        return self.summary(games_ago)["dfr"]
 
     @cached(5 * 60, 'handle')
     def topmaps(self, games_ago):
-        games = self.last_games(games_ago)
-        maps = [r[0] for r in (Game.query
-                               .with_entities(Game.map)
-                               .filter(Game.id.in_(games))
-                               )]
-        ret = {}
-        for map_ in set(maps):
-            ret[map_] = maps.count(map_)
+        # Games from this one on are the last <games_ago> games.
+        start = (self.game_ids[-games_ago]
+                 if 0 < games_ago <= len(self.game_ids) else 0)
+        ret = dict(GamePlayer.query.join(Game).with_entities(
+            Game.map, db.func.count(db.distinct(Game.id)))
+            .filter(GamePlayer.handle == self.handle, Game.id >= start)
+            .group_by(Game.map))
         return [{"name": m, "games": ret[m]}
                 for m in sorted(sorted(ret),
                                 key=lambda m: ret[m], reverse=True)]
 
+    def career(self):
+        # Return the all-time totals of Player.
+        return careers.career(self.handle) or careers.new_career()
+
     def weapons(self):
+        sums = self.career()["weapons"]
         ret = {}
         for weapon in redeclipse.versions.default.weaponlist:
-            ret[weapon] = Weapon.from_player(weapon, self.handle)
+            ret[weapon] = Weapon.from_sums(weapon, sums.get(weapon))
         return ret
 
     def to_dict(self):
         return direct_to_dict(self, [
-            "handle", "game_ids"
-        ])
+            "handle"
+        ], {
+            "game_ids": list(self.game_ids),
+            "career": select(self.career(), Player.career_fields),
+        })
 
 
 class Server:
@@ -182,22 +239,18 @@ class Server:
     @staticmethod
     def handle_list():
         # Return a list of all server handles in the database.
-        return [r[0] for r in
-                GameServer.query.with_entities(GameServer.handle).filter(
-                GameServer.handle != '').group_by(GameServer.handle)
-                .order_by(GameServer.game_id.desc()).all()]
+        return postings.keys('server')
 
     @staticmethod
     def count():
         # Return the number of handles in the database.
-        return GameServer.query.filter(
-            GameServer.handle != '').group_by(GameServer.handle).count()
+        return len(Server.handle_list())
 
     @staticmethod
+    @per_request
     def get_or_404(handle):
         # Return a Server for <handle> if <handle> exists, otherwise 404.
-        handles = Server.handle_list()
-        if handle in handles:
+        if postings.game_ids('server', handle):
             return Server(handle)
         else:
             raise NotFound
@@ -210,50 +263,61 @@ class Server:
         if pagesize is not None:
             filtered_handles = handles[
                 page * pagesize:page * pagesize + pagesize]
-        return [Server(handle) for handle in filtered_handles]
+        return Server.many(filtered_handles)
 
     @classmethod
     def paginate(cls, page, per_page):
         return to_pagination(page, per_page, cls.all, cls.count)
 
-    def __init__(self, handle):
-        # Build a Server object from the database.
+    @staticmethod
+    def many(handles):
+        # Return Servers for <handles>, loading the GameServers of their
+        # first and latest games, with the games, in one query.
+        ends = {handle: postings.game_ids('server', handle)
+                for handle in handles}
+        gameids = {ids[i] for ids in ends.values() for i in (0, -1)}
+        rows = {}
+        if handles:
+            rows = {row.game_id: row for row in
+                    GameServer.query
+                    .options(db.joinedload(GameServer.game))
+                    .filter(GameServer.game_id.in_(gameids))}
+        return [Server(handle, rows[ends[handle][0]], rows[ends[handle][-1]])
+                for handle in handles]
+
+    def __init__(self, handle, first=None, latest=None):
+        # Build a Server object from the database, unless the GameServers of
+        # its <first> and <latest> games are given.
         self.handle = handle
-        all_games = [r[0] for r in Game.query.with_entities(Game.id).all()]
-        self.game_ids = [r[0] for r in GameServer.query.with_entities(
-            GameServer.game_id).filter(GameServer.handle == self.handle).all()
-            if r[0] in all_games]
-        self.latest = GameServer.query.filter(
+        self.game_ids = postings.game_ids('server', self.handle)
+        self.latest = latest or GameServer.query.filter(
             GameServer.game_id == self.game_ids[-1]).first()
-        self.first = GameServer.query.filter(
+        self.first = first or GameServer.query.filter(
             GameServer.game_id == self.game_ids[0]).first()
 
-    def games(self, page=0, pagesize=None):
-        # Return full Game objects from Server's game_ids.
-        ids = (self.game_ids[page * pagesize:page * pagesize + pagesize]
-               if pagesize is not None else
-               self.game_ids)
-        if not ids:
-            return []
-        return Game.query.filter(Game.id.in_(ids)).all()
+    def games(self, page, pagesize, newest_first=False):
+        # Return the GameBundles of Server's game_ids.
+        return entity_games(self, page, pagesize, newest_first)
+
+    def games_count(self):
+        # Return the number of games, without loading them.
+        return len(self.game_ids)
 
     def recent_games(self, number):
-        ids = reversed(self.game_ids[-number:])
-        if not ids:
-            return []
-        return Game.query.filter(
-            Game.id.in_(ids)).order_by(Game.id.desc()).all()
+        return self.games(0, number, True)
 
-    def games_paginate(self, page, per_page):
-        return to_pagination(page, per_page, self.games,
-                             lambda: len(self.game_ids))
+    def games_paginate(self, page, per_page, newest_first=False):
+        return to_pagination(page, per_page,
+                             lambda a, b: self.games(a, b, newest_first),
+                             self.games_count)
 
     def to_dict(self):
         return direct_to_dict(self, [
-            "handle", "game_ids"
+            "handle"
         ], {
-            "latest": self.latest,
-            "first": self.first,
+            "game_ids": list(self.game_ids),
+            "latest": self.latest.to_dict(),
+            "first": self.first.to_dict(),
         })
 
 
@@ -261,32 +325,29 @@ class Map:
     @staticmethod
     def map_list(race=False):
         if race:
-            return [r[0] for r in
-                    Game.query.with_entities(Game.map)
-                    .filter(db.func.re_mode(Game.id, 'race'))
-                    .filter(db.func.re_mut(Game.id, 'timed'))
-                    .group_by(Game.map)
-                    .order_by(Game.id.desc()).all()]
+            # Return the maps with timed races, newest first by their first.
+            races = postings.intersect(postings.game_ids('mode', 'race'),
+                                       postings.game_ids('mutator',
+                                                         'race-timed'))
+            firsts = []
+            for name in postings.keys('map'):
+                ids = postings.intersect(races, postings.game_ids('map', name))
+                if ids:
+                    firsts.append((ids[0], name))
+            return [name for first, name in sorted(firsts, reverse=True)]
         # Return a list of all map names in the database.
-        return [r[0] for r in
-                Game.query.with_entities(Game.map).group_by(Game.map)
-                .order_by(Game.id.desc()).all()]
+        return postings.keys('map')
 
     @staticmethod
     def count(race=False):
         # Return the number of maps in the database.
-        if race:
-            return (Game.query.with_entities(Game.map)
-                    .filter(db.func.re_mode(Game.id, 'race'))
-                    .filter(db.func.re_mut(Game.id, 'timed'))
-                    .group_by(Game.map).count())
-        return Game.query.with_entities(Game.map).group_by(Game.map).count()
+        return len(Map.map_list(race))
 
     @staticmethod
+    @per_request
     def get_or_404(name):
         # Return a Map for <name> if <name> exists, otherwise 404.
-        names = Map.map_list()
-        if name in names:
+        if postings.game_ids('map', name):
             return Map(name)
         else:
             raise NotFound
@@ -299,7 +360,20 @@ class Map:
         if pagesize is not None:
             filtered_names = names[
                 page * pagesize:page * pagesize + pagesize]
-        return [Map(name) for name in filtered_names]
+        return Map.many(filtered_names)
+
+    @staticmethod
+    def many(names):
+        # Return Maps for <names>, loading their first and latest games in
+        # one query.
+        ends = {name: postings.game_ids('map', name) for name in names}
+        gameids = {ids[i] for ids in ends.values() for i in (0, -1)}
+        games = {}
+        if names:
+            games = {game.id: game for game in
+                     Game.query.filter(Game.id.in_(gameids))}
+        return [Map(name, games[ends[name][0]], games[ends[name][-1]])
+                for name in names]
 
     @classmethod
     def paginate(cls, page, per_page, race=False):
@@ -307,94 +381,60 @@ class Map:
                              lambda a, b: cls.all(a, b, race),
                              lambda: cls.count(True))
 
-    def __init__(self, name):
-        # Build a Map object from the database.
+    def __init__(self, name, first=None, latest=None):
+        # Build a Map object from the database, unless its <first> and
+        # <latest> games are given.
         self.name = name
-        self.game_ids = [
-            r[0] for r in
-            Game.query.with_entities(Game.id).filter(
-                Game.map == self.name
-            ).all()
-        ]
-        self.latest = Game.query.filter(
+        self.game_ids = postings.game_ids('map', self.name)
+        self.latest = latest or Game.query.filter(
             Game.id == self.game_ids[-1]).first()
-        self.first = Game.query.filter(
+        self.first = first or Game.query.filter(
             Game.id == self.game_ids[0]).first()
-        self.gametime = Game.query.with_entities(
+
+    def gametime(self):
+        # Return the time played on the map.
+        return Game.query.with_entities(
             db.func.sum(Game.timeplayed)).filter(
                 Game.map == self.name
             ).first()[0]
-        self.playertime = GamePlayer.query.with_entities(
+
+    def playertime(self):
+        # Return the combined time of the players on the map.
+        return GamePlayer.query.join(Game).with_entities(
             db.func.sum(GamePlayer.timeactive)).filter(
-                GamePlayer.game_id.in_(self.game_ids)
+                Game.map == self.name
             ).first()[0]
 
-    def games(self, page=0, pagesize=None):
-        # Return full Game objects from Map's game_ids.
-        ids = (self.game_ids[page * pagesize:page * pagesize + pagesize]
-               if pagesize is not None else
-               self.game_ids)
-        if not ids:
-            return []
-        return Game.query.filter(Game.id.in_(ids)).all()
+    def games(self, page, pagesize, newest_first=False):
+        # Return the GameBundles of Map's game_ids.
+        return entity_games(self, page, pagesize, newest_first)
+
+    def games_count(self):
+        # Return the number of games, without loading them.
+        return len(self.game_ids)
 
     def recent_games(self, number):
-        ids = reversed(self.game_ids[-number:])
-        if not ids:
-            return []
-        return Game.query.filter(
-            Game.id.in_(ids)).order_by(Game.id.desc()).all()
+        return self.games(0, number, True)
 
-    def games_paginate(self, page, per_page):
-        return to_pagination(page, per_page, self.games,
-                             lambda: len(self.game_ids))
+    def games_paginate(self, page, per_page, newest_first=False):
+        return to_pagination(page, per_page,
+                             lambda a, b: self.games(a, b, newest_first),
+                             self.games_count)
 
     def topraces(self, endurance=False):
-        # Return a dictionary of the top race times.
-        return [
-            {
-                "game_id": r[0],
-                "handle": r[1],
-                "name": r[2],
-                "score": r[3],
-                "when": r[4],
-            }
-            for r in
-            (
-                GamePlayer.query
-                # We only need some information.
-                .with_entities(
-                    GamePlayer.game_id, GamePlayer.handle,
-                    GamePlayer.name, GamePlayer.score,
-                    Game.time,
-                )
-                .join(Game)
-                # Only games from this map.
-                .filter(GamePlayer.game_id.in_(self.game_ids))
-                # Only timed race.
-                .filter(db.func.re_mode(GamePlayer.game_id, 'race'))
-                .filter(db.func.re_mut(GamePlayer.game_id, 'timed'))
-                .filter(True
-                        if not endurance else
-                        db.func.re_mut(GamePlayer.game_id, 'endurance'))
-                # No freestyle.
-                .filter(~db.func.re_mut(GamePlayer.game_id, 'freestyle'))
-                # Scores of 0 indicate the race was never completed.
-                .filter(GamePlayer.score > 0)
-                # Get only the best score from each handle.
-                .group_by(GamePlayer.handle)
-                .having(db.func.min(GamePlayer.score))
-                # Finally: order, limit, and fetch.
-                .order_by(GamePlayer.score.asc())
-                .limit(current_app.config['API_HIGHSCORE_RESULTS'])
-                .all()
-            )
-        ]
+        # Return a list of the top race times, one per handle.
+        return leaderboards.top(self.name, endurance,
+                                current_app.config['API_HIGHSCORE_RESULTS'])
+
+    def best_race(self, handle, endurance=False):
+        # Return handle's best race time with its rank, or None.
+        return leaderboards.best(self.name, handle, endurance)
 
     def to_dict(self):
         return direct_to_dict(self, [
-            "name", "game_ids"
+            "name"
         ], {
+            "game_ids": list(self.game_ids),
             "topraces": self.topraces(),
         })
 
@@ -429,39 +469,37 @@ class Mode:
         re = redeclipse.versions.default
         self.name = name
         self.longname = re.modestr[re.modes[self.name]]
-        self.game_ids = [
-            r[0] for r in
-            Game.query.with_entities(Game.id).filter(
-                db.func.re_mode(Game.id, self.name)).all()
-        ]
+        self.game_ids = postings.game_ids('mode', self.name)
 
     def mode_str(self, short=False):
         return self.name if short else self.longname
 
-    def games(self, page=0, pagesize=None):
-        # Return full Game objects from Mode's game_ids.
-        ids = (self.game_ids[page * pagesize:page * pagesize + pagesize]
-               if pagesize is not None else
-               self.game_ids)
-        if not ids:
-            return []
-        return Game.query.filter(Game.id.in_(ids)).all()
+    def games(self, page, pagesize, newest_first=False):
+        # Return the GameBundles of Mode's game_ids.
+        return entity_games(self, page, pagesize, newest_first)
+
+    def games_count(self):
+        # Return the number of games, without loading them.
+        return len(self.game_ids)
 
     def recent_games(self, number):
-        ids = reversed(self.game_ids[-number:])
-        if not ids:
-            return []
-        return Game.query.filter(
-            Game.id.in_(ids)).order_by(Game.id.desc()).all()
+        return self.games(0, number, True)
 
-    def games_paginate(self, page, per_page):
-        return to_pagination(page, per_page, self.games,
-                             lambda: len(self.game_ids))
+    def games_paginate(self, page, per_page, newest_first=False):
+        return to_pagination(page, per_page,
+                             lambda a, b: self.games(a, b, newest_first),
+                             self.games_count)
 
-    def to_dict(self):
-        return direct_to_dict(self, [
-            "name", "game_ids"
-        ])
+    def to_dict(self, page=None, pagesize=None):
+        # Only count the games, unless a page of their ids is asked for.
+        ret = direct_to_dict(self, [
+            "name"
+        ], {
+            "games": self.games_count(),
+        })
+        if page is not None:
+            ret["game_ids"] = list(page_ids(self.game_ids, page, pagesize))
+        return ret
 
 
 class Mutator:
@@ -496,46 +534,34 @@ class Mutator:
 
     def __init__(self, name):
         self.name = name
-        if '-' in self.name:
-            self.game_ids = [
-                r[0] for r in
-                Game.query.with_entities(Game.id)
-                .filter(db.func.re_mut(Game.id, self.name.split("-")[1]))
-                .filter(db.func.re_mode(Game.id, self.name.split("-")[0]))
-                .all()
-            ]
-        else:
-            self.game_ids = [
-                r[0] for r in
-                Game.query.with_entities(Game.id)
-                .filter(db.func.re_mut(Game.id, self.name))
-                .all()
-            ]
-
-    def games(self, page=0, pagesize=None):
-        # Return full Game objects from Mutator's game_ids.
-        ids = (self.game_ids[page * pagesize:page * pagesize + pagesize]
-               if pagesize is not None else
-               self.game_ids)
-        if not ids:
-            return []
-        return Game.query.filter(Game.id.in_(ids)).all()
+        self.game_ids = postings.game_ids('mutator', self.name)
+
+    def games(self, page, pagesize, newest_first=False):
+        # Return the GameBundles of Mutator's game_ids.
+        return entity_games(self, page, pagesize, newest_first)
+
+    def games_count(self):
+        # Return the number of games, without loading them.
+        return len(self.game_ids)
 
     def recent_games(self, number):
-        ids = reversed(self.game_ids[-number:])
-        if not ids:
-            return []
-        return Game.query.filter(
-            Game.id.in_(ids)).order_by(Game.id.desc()).all()
+        return self.games(0, number, True)
 
-    def games_paginate(self, page, per_page):
-        return to_pagination(page, per_page, self.games,
-                             lambda: len(self.game_ids))
+    def games_paginate(self, page, per_page, newest_first=False):
+        return to_pagination(page, per_page,
+                             lambda a, b: self.games(a, b, newest_first),
+                             self.games_count)
 
-    def to_dict(self):
-        return direct_to_dict(self, [
-            "name", "game_ids"
-        ])
+    def to_dict(self, page=None, pagesize=None):
+        # Only count the games, unless a page of their ids is asked for.
+        ret = direct_to_dict(self, [
+            "name"
+        ], {
+            "games": self.games_count(),
+        })
+        if page is not None:
+            ret["game_ids"] = list(page_ids(self.game_ids, page, pagesize))
+        return ret
 
 
 class Weapon:
@@ -569,10 +595,12 @@ class Weapon:
         return weapon
 
     @staticmethod
-    def from_player(weapon, player):
-        return Weapon.finish_query(weapon, GameWeapon.query.filter(
-            GameWeapon.weapon == weapon).filter(
-                GameWeapon.playerhandle == player))
+    def from_sums(name, sums):
+        # Build a Weapon from its column sums, in the order of columns.
+        weapon = Weapon(name)
+        for c, value in zip(Weapon.columns, sums or [0] * len(Weapon.columns)):
+            setattr(weapon, c, value)
+        return weapon
 
     @staticmethod
     def from_player_games(weapon, player, games):
@@ -657,3 +685,289 @@ class Weapon:
         return direct_to_dict(self, [
             "name"
         ] + Weapon.columns)
+
+
+class GameBundle:
+    """
+    Everything about a game, loaded with one query per table.
+
+    Games never change once written, so bundles are kept in a size-bounded
+    LRU cache instead of expiring. Don't modify them.
+    """
+
+    # The tables of a game and the order of their rows.
+    tables = [
+        (GamePlayer, [GamePlayer.wid]),
+        (GameTeam, [GameTeam.team]),
+        (GameFFARound, [GameFFARound.player, GameFFARound.round]),
+        (GameCapture, [GameCapture.rowid]),
+        (GameBombing, [GameBombing.rowid]),
+        (GameServer, []),
+        (GameWeapon, []),
+    ]
+
+    # The columns of the game in to_dict.
+    columns = [
+        "id", "time",
+        "map", "mode", "mutators",
+        "timeplayed", "uniqueplayers",
+        "usetotals"
+    ]
+
+    # The other parts of to_dict and the tables they are built from, those
+    # with a dot are parts of each player.
+    parts = OrderedDict([
+        ("teams", [GameTeam]),
+        ("players", [GamePlayer]),
+        ("players.bombings", [GameBombing]),
+        ("players.captures", [GameCapture]),
+        ("ffarounds", [GameFFARound]),
+        ("server", [GameServer]),
+    ])
+
+    @staticmethod
+    def selection(fields=None, expand=None):
+        # Return {<column or part>: <its fields or None for all>} of what to
+        # include in to_dict. <fields> are columns and parts, or
+        # "<part>.<field>" to include only some fields of a part, <expand>
+        # are the parts to include, an expanded sub-part is included whatever
+        # the fields of its part. None includes everything.
+        ret = {}
+        for name in GameBundle.columns + list(GameBundle.parts):
+            parent, dot, field = name.partition(".")
+            if dot:
+                if parent in ret and (
+                        (expand is not None and name in expand) or
+                        (expand is None and
+                         (ret[parent] is None or field in ret[parent]))):
+                    ret[name] = None
+                continue
+            if expand is not None and name in GameBundle.parts and not any(
+                    e == name or e.startswith(name + ".") for e in expand):
+                continue
+            if fields is None or name in fields:
+                ret[name] = None
+                continue
+            subfields = {f.partition(".")[2] for f in fields
+                         if f.startswith(name + ".")}
+            if subfields:
+                ret[name] = subfields
+        return ret
+
+    @staticmethod
+    def models(selection):
+        # Return the tables needed for to_dict(<selection>), None for all of
+        # them if it is the whole game so the bundles can be kept.
+        if selection == GameBundle.selection():
+            return None
+        return [model for model, order in GameBundle.tables
+                if any(model in tables
+                       for part, tables in GameBundle.parts.items()
+                       if part in selection)]
+
+    @staticmethod
+    def get_many(gameids, models=None):
+        # Return {<game id>: <GameBundle>} of those of <gameids> that exist,
+        # loading the missing ones together. If <models> is given only their
+        # tables are loaded for them, and those bundles are not kept.
+        ret = {}
+        with bundles_lock:
+            for gameid in gameids:
+                if gameid in bundles:
+                    bundles.move_to_end(gameid)
+                    ret[gameid] = bundles[gameid]
+        missing = [gameid for gameid in gameids if gameid not in ret]
+        if not missing:
+            return ret
+        games = Game.query.filter(Game.id.in_(missing)).all()
+        rows = {game.id: {model: [] for model, order in GameBundle.tables}
+                for game in games}
+        for model, order in GameBundle.tables:
+            if models is not None and model not in models:
+                continue
+            for row in (model.query.filter(model.game_id.in_(missing))
+                        .order_by(model.game_id, *order)):
+                db.session.expunge(row)
+                rows[row.game_id][model].append(row)
+        complete = models is None or all(
+            model in models for model, order in GameBundle.tables)
+        with bundles_lock:
+            for game in games:
+                db.session.expunge(game)
+                ret[game.id] = GameBundle(game, rows[game.id])
+                if complete:
+                    bundles[game.id] = ret[game.id]
+            while len(bundles) > current_app.config['GAME_BUNDLE_CACHE']:
+                bundles.popitem(last=False)
+        return ret
+
+    @staticmethod
+    def get_or_404(gameid, models=None):
+        # Return the GameBundle of <gameid> if it exists, otherwise 404.
+        bundle = GameBundle.get_many([gameid], models).get(gameid)
+        if bundle is None:
+            raise NotFound
+        return bundle
+
+    def __init__(self, game, rows):
+        # Build a GameBundle from game and {<model>: [<row>, ...]}.
+        self.game = game
+        self.id = game.id
+        self.time = game.time
+        self.map = game.map
+        self.mode = game.mode
+        self.mutators = game.mutators
+        self.timeplayed = game.timeplayed
+        self.players = tuple(rows[GamePlayer])
+        self.teams = tuple(rows[GameTeam])
+        self.ffarounds = tuple(rows[GameFFARound])
+        self.captures = tuple(rows[GameCapture])
+        self.bombings = tuple(rows[GameBombing])
+        self.server = rows[GameServer][0] if rows[GameServer] else None
+        # A game without a server row has no version, it is shown with the
+        # default one like the games of unknown versions.
+        self.version = redeclipse.versions.cached_game_version(game.id)
+        if self.version is None:
+            self.version = redeclipse.versions.get_version_class(
+                self.server.version if self.server is not None
+                else redeclipse.versions.DEFAULT_VERSION)
+        re = self.version
+        muts = re.mutslist(game.mode, game.mutators)
+        self.timed = game.mode == re.modes['race'] and 'timed' in muts
+        self.peaceful = (game.mode == re.modes['race'] and
+                         'gauntlet' not in muts)
+        # to_json() of the whole game.
+        self.encoded = None
+
+        self.wids = {p.wid: p for p in self.players}
+        self.teams_by_id = {t.team: t for t in self.teams}
+        self.damages = {}
+        sums = {}
+        self.totalwielded = None
+        for w in rows[GameWeapon]:
+            self.damages[w.player] = (self.damages.get(w.player, 0) +
+                                      (w.damage1 or 0) + (w.damage2 or 0))
+            old = sums.get(w.weapon, [0] * len(Weapon.columns))
+            sums[w.weapon] = [a + (getattr(w, c) or 0)
+                              for a, c in zip(old, Weapon.columns)]
+            if w.timewielded is not None:
+                self.totalwielded = (self.totalwielded or 0) + w.timewielded
+        self.weapons = tuple(Weapon.from_sums(n, sums.get(n))
+                             for n in Weapon.weapon_list())
+
+    def re(self):
+        return self.version
+
+    def is_timed(self):
+        return self.timed
+
+    def is_peaceful(self):
+        return self.peaceful
+
+    def mode_str(self, short=False):
+        re = self.version
+        return re.cmodestr[self.mode] if short else re.modestr[self.mode]
+
+    def mutator_list(self, maxlong=0):
+        re = self.version
+        muts = re.mutslist(self.mode, self.mutators)
+        if maxlong and len(muts) > maxlong:
+            return re.mutslist(self.mode, self.mutators, True)
+        return muts
+
+    def mutator_dict_list(self, maxlong=0):
+        re = self.version
+        return re.mutator_dicts(
+            self.mode, self.mutators,
+            bool(maxlong and
+                 len(re.mutslist(self.mode, self.mutators)) > maxlong))
+
+    def ordered_players(self):
+        if self.timed:
+            return (sorted([p for p in self.players if p.score != 0],
+                           key=lambda p: p.score) +
+                    [p for p in self.players if p.score == 0])
+        return sorted(self.players,
+                      key=lambda p: (-p.score, -p.frags, p.deaths))
+
+    def ordered_teams(self):
+        if self.timed:
+            return (sorted([t for t in self.teams if t.score != 0],
+                           key=lambda t: t.score) +
+                    [t for t in self.teams if t.score == 0])
+        return sorted(self.teams, key=lambda t: -t.score)
+
+    def player_by_wid(self, wid):
+        return self.wids.get(wid)
+
+    def player_by_handle(self, handle):
+        return next((p for p in self.players if p.handle == handle), None)
+
+    def team(self, team):
+        return self.teams_by_id.get(team)
+
+    def damage(self, wid):
+        return self.damages.get(wid, 0)
+
+    def combined_ffarounds(self):
+        # Combine the various game_ffarounds entries into a single list.
+        ffarounds = {}
+        for ffaround in self.ffarounds:
+            index = ffaround.round
+            if index not in ffarounds:
+                ffarounds[index] = {
+                    "round": index,
+                    "winner": None,
+                    "players": [],
+                }
+            if ffaround.winner:
+                ffarounds[index]["winner"] = ffaround.player
+            ffarounds[index]["players"].append(ffaround.player)
+        return ffarounds
+
+    def full_weapons(self):
+        return {w.name: w for w in self.weapons}
+
+    def player_to_dict(self, player, selection=None):
+        if selection is None:
+            selection = GameBundle.selection()
+        ret = select(direct_to_dict(player, [
+            "game_id", "name", "handle",
+            "score", "timealive", "frags", "deaths", "wid", "timeactive"
+        ]), selection["players"])
+        if "players.bombings" in selection:
+            ret["bombings"] = [b.to_dict() for b in self.bombings
+                               if b.player == player.wid]
+        if "players.captures" in selection:
+            ret["captures"] = [c.to_dict() for c in self.captures
+                               if c.player == player.wid]
+        return ret
+
+    def to_dict(self, selection=None):
+        # Return the game as a dict, only with <selection>, see selection().
+        if selection is None:
+            selection = GameBundle.selection()
+        ret = select(direct_to_dict(self.game, GameBundle.columns), selection)
+        if "teams" in selection:
+            ret["teams"] = {t.team: select(t.to_dict(), selection["teams"])
+                            for t in self.teams}
+        if "players" in selection:
+            ret["players"] = {p.wid: self.player_to_dict(p, selection)
+                              for p in self.players}
+        if "ffarounds" in selection:
+            ret["ffarounds"] = {
+                n: select(r, selection["ffarounds"])
+                for n, r in self.combined_ffarounds().items()}
+        if "server" in selection:
+            ret["server"] = (select(self.server.to_dict(), selection["server"])
+                             if self.server is not None else None)
+        return ret
+
+    def to_json(self, selection=None):
+        # Return to_dict(<selection>) as fastjson.Raw, the whole game is only
+        # encoded once.
+        if selection is not None and selection != GameBundle.selection():
+            return fastjson.Raw(fastjson.dumps(self.to_dict(selection)))
+        if self.encoded is None:
+            self.encoded = fastjson.Raw(fastjson.dumps(self.to_dict()))
+        return self.encoded
@@ -178,50 +178,32 @@ class Game(db.Model):
         return redeclipse.versions.get_game_version(self.id)
 
     def is_timed(self):
-        return (self.mode == self.re().modes['race'] and
-                'timed' in self.re().mutslist(self.mode, self.mutators))
+        re = self.re()
+        return (self.mode == re.modes['race'] and
+                'timed' in re.mutslist(self.mode, self.mutators))
 
     def is_peaceful(self):
-        return (self.mode == self.re().modes['race'] and
-                'gauntlet' not in self.re().mutslist(self.mode, self.mutators))
+        re = self.re()
+        return (self.mode == re.modes['race'] and
+                'gauntlet' not in re.mutslist(self.mode, self.mutators))
 
     def mode_str(self, short=False):
-        return (self.re().cmodestr[self.mode] if short else
-                self.re().modestr[self.mode])
+        re = self.re()
+        return re.cmodestr[self.mode] if short else re.modestr[self.mode]
 
     def mutator_list(self, maxlong=0):
-        return self.re().mutslist(self.mode, self.mutators,
-                                  (maxlong and len(self.re().mutslist(
-                                   self.mode, self.mutators)) > maxlong))
+        re = self.re()
+        muts = re.mutslist(self.mode, self.mutators)
+        if maxlong and len(muts) > maxlong:
+            return re.mutslist(self.mode, self.mutators, True)
+        return muts
 
     def mutator_dict_list(self, maxlong=0):
-        ret = []
         re = self.re()
-
-        for m in re.basemuts:
-            if self.mutators & re.basemuts[m]:
-                ret.append({
-                    "link": m,
-                    "name": m,
-                    "longname": m,
-                    "shortname": re.shortmutators[m],
-                    })
-
-        if self.mode in re.gspmuts:
-            for m in re.gspmuts[self.mode]:
-                if self.mutators & re.gspmuts[self.mode][m]:
-                    mn = re.cmodestr[self.mode] + '-' + m
-                    ret.append({
-                        "link": mn,
-                        "name": m,
-                        "longname": m,
-                        "shortname": re.shortmutators[m],
-                    })
-
-        if maxlong and len(ret) > maxlong:
-            for m in ret:
-                m["name"] = m["shortname"]
-        return ret
+        return re.mutator_dicts(
+            self.mode, self.mutators,
+            bool(maxlong and
+                 len(re.mutslist(self.mode, self.mutators)) > maxlong))
 
     def ordered_players(self):
         if self.is_timed():
@@ -12,8 +12,52 @@ API_RESULTS_PER_PAGE = 25
 # Number of results to return in a highscore list. (e.g. topraces)
 API_HIGHSCORE_RESULTS = 10
 
+# Number of paths a /api/batch request can combine.
+API_BATCH_LIMIT = 30
+
+# Encoder of the API responses, 'orjson', 'ujson' or 'json'. None uses the
+# fastest one installed.
+JSON_ENCODER = None
+
 # Number of results to return in a display list page.
 DISPLAY_RESULTS_PER_PAGE = 15
 
 # Number of results to return in a 'recent' list.
 DISPLAY_RESULTS_RECENT = 10
+
+# File in the data directory to save the startup indexes to, so a restart only
+# has to process new games. Set to None to always rebuild them.
+CACHE_SNAPSHOT = 'statsdbinterface.cache'
+
+# Number of games to keep loaded for the game pages, the least recently viewed
+# are dropped first.
+GAME_BUNDLE_CACHE = 1000
+
+# Number of the latest games /api/stream/games can resume from.
+STREAM_BACKLOG = 1000
+# Seconds between checks for new games to push to /api/stream/games.
+STREAM_POLL = 5
+
+# Set to False to disable recording metrics and serving them on /metrics.
+METRICS = True
+
+# Set to True to add X-Query-Count, X-Query-Time and X-Query-Repeated headers
+# to each response, append ?sqlprofile=json to a URL to get the full profile.
+SQL_PROFILE = False
+
+# Number of statements of the same shape in a request to report as N+1.
+SQL_PROFILE_REPEATED = 5
+
+# Set to True to fail requests which execute more SQL statements than the
+# budget declared on their view, e.g. while working on the views.
+QUERY_BUDGETS = False
+
+# Profile requests slower than this many seconds and write their stacks, in
+# the collapsed format of flamegraph.pl, to PROFILE_DIR. None disables it.
+PROFILE_SLOW_REQUESTS = None
+# Directory in the data directory to write the profiles to.
+PROFILE_DIR = 'profiles'
+# Number of profiles to keep, the oldest ones are removed first.
+PROFILE_KEEP = 100
+# Addresses allowed to append ?profile=1 to a URL to get its profile.
+PROFILE_ADMINS = []
@@ -0,0 +1,113 @@
+import json
+import re
+import secrets
+from collections import OrderedDict
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# JSON encoders, fastest first, and whether they are installed.
+# <name>: (<installed>, <function returning obj as JSON bytes>)
+encoders = OrderedDict()
+# Replaces the Raw values in the output of an encoder.
+marker = "rawjson-%s-" % secrets.token_hex(16)
+marker_re = re.compile(b'"' + marker.encode() + rb'(\d+)"')
+
+
+def encoder(name, installed):
+    """
+    Decorator, registers an encoder. It is called with the object and a
+    function returning a replacement for the objects it can't encode.
+    """
+    def wrapper(f):
+        encoders[name] = (installed, f)
+        return f
+
+    return wrapper
+
+
+@encoder("orjson", orjson is not None)
+def encode_orjson(obj, default):
+    # Integer keys are sorted as strings.
+    return orjson.dumps(obj, default=default,
+                        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+
+
+@encoder("ujson", ujson is not None)
+def encode_ujson(obj, default):
+    return ujson.dumps(obj, default=default, sort_keys=True,
+                       ensure_ascii=False,
+                       escape_forward_slashes=False).encode()
+
+
+@encoder("json", True)
+def encode_json(obj, default):
+    # The same output as flask.jsonify.
+    return json.dumps(obj, default=default, sort_keys=True,
+                      separators=(",", ":")).encode()
+
+
+encode = encode_json
+
+
+class Raw:
+    """
+    Encoded JSON, spliced into the output of dumps as it is.
+    """
+
+    __slots__ = ["data"]
+
+    def __init__(self, data):
+        self.data = data
+
+
+def dumps(obj):
+    """
+    Return obj as JSON bytes, with the data of the Raw values in it spliced
+    in without decoding it.
+    """
+    raws = []
+
+    def default(o):
+        if isinstance(o, Raw):
+            raws.append(o.data)
+            return "%s%d" % (marker, len(raws) - 1)
+        raise TypeError("Object of type %s is not JSON serializable" %
+                        type(o).__name__)
+
+    data = encode(obj, default)
+    if not raws:
+        return data
+    return marker_re.sub(lambda m: raws[int(m.group(1))], data)
+
+
+def jsonify(*args, **kwargs):
+    """
+    flask.jsonify with the configured encoder, Raw values are spliced in.
+    """
+    if args and kwargs:
+        raise TypeError("jsonify() takes either args or kwargs, not both")
+    data = args[0] if len(args) == 1 else args or kwargs
+    return current_app.response_class(
+        dumps(data) + b"\n", mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def setup(app):
+    """
+    Encode with JSON_ENCODER, or the fastest installed encoder.
+    """
+    global encode
+    name = app.config['JSON_ENCODER']
+    if name is None:
+        name = next(n for n, (installed, f) in encoders.items() if installed)
+    if name not in encoders or not encoders[name][0]:
+        raise ValueError("JSON_ENCODER %s is not installed." % name)
+    encode = encoders[name][1]
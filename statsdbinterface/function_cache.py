@@ -1,7 +1,12 @@
+import functools
 import time
 from threading import Thread, Lock
 import atexit
+from flask import g, has_app_context
 cache = {}
+# <function name>: [<hits>, <misses>, <evictions>]
+stats = {}
+names = {}
 cache_cleaner_thread = None
 cache_lock = Lock()
 cache_cleaner_running = False
@@ -12,6 +17,11 @@ def cached(seconds, cattr=None):
     Decorator, registers function to the cache.
     """
     def wrapper(f):
+        name = "%s.%s" % (f.__module__, f.__qualname__)
+        names[id(f)] = name
+        stats[name] = [0, 0, 0]
+
+        @functools.wraps(f)
         def function(*args, **kwargs):
             # Construct key from the function id and arguments.
             if cattr is None:
@@ -26,6 +36,7 @@ def cached(seconds, cattr=None):
             with cache_lock:
                 if key not in cache:
                     needresults = True
+                stats[name][1 if needresults else 0] += 1
             if needresults:
                 results = f(*args, **kwargs)
                 with cache_lock:
@@ -36,6 +47,24 @@ def cached(seconds, cattr=None):
     return wrapper
 
 
+def per_request(f):
+    """
+    Decorator, reuses the results of f for the rest of the request, so the
+    parts of an /api/batch request share them.
+    """
+    @functools.wraps(f)
+    def function(*args):
+        if not has_app_context():
+            return f(*args)
+        if 'per_request' not in g:
+            g.per_request = {}
+        key = (id(f), args)
+        if key not in g.per_request:
+            g.per_request[key] = f(*args)
+        return g.per_request[key]
+    return function
+
+
 def cleaner():
     while cache_cleaner_running:
         # Clean every minute, but periodically test for exit.
@@ -50,6 +79,7 @@ def cleaner():
         for key in todelete:
             with cache_lock:
                 cache.pop(key)
+                stats[names[key[0]]][2] += 1
 
 
 def cancel_cleaner():
@@ -0,0 +1,53 @@
+from threading import Lock
+from flask import current_app
+from .database.core import db
+
+registry = []
+# The last game passed to each index.
+# <name>: <game id>
+lastgames = {}
+update_lock = Lock()
+
+
+def index(name, dump, load):
+    """
+    Decorator, registers f(first, last) as the builder of an index.
+
+    The builder is passed the inclusive range of game ids which have not been
+    indexed yet, dump() returns the index state for the snapshot and
+    load(state) restores it. A builder must not change its index before it
+    has read everything, if it raises it is passed the same games again.
+    """
+    def wrapper(f):
+        registry.append((name, f, dump, load))
+        return f
+
+    return wrapper
+
+
+def latest_game():
+    from .database.models import Game
+    return Game.query.with_entities(db.func.max(Game.id)).scalar() or 0
+
+
+def update():
+    """
+    Pass all games added since the last update to every index.
+
+    If an index fails it is logged, and it and the indexes after it, which
+    can depend on it, are retried with the next update.
+    """
+    with update_lock:
+        latest = latest_game()
+        for name, f, dump, load in registry:
+            first = lastgames.get(name, 0) + 1
+            if first > latest:
+                continue
+            try:
+                f(first, latest)
+            except Exception:
+                current_app.logger.exception(
+                    "Indexing games %d to %d failed in %s", first, latest,
+                    name)
+                return
+            lastgames[name] = latest
@@ -0,0 +1,94 @@
+from bisect import bisect_left, insort
+from . import indexes
+from .redeclipse import versions
+
+# Best timed race per handle, by (map, endurance only).
+# <handle>: (<score>, <game id>, <name>, <time>)
+boards = {}
+# The same entries as (<score>, <game id>, <handle>), sorted.
+ranked = {}
+
+
+def add(key, handle, entry):
+    """
+    Record a race, if it is the best of handle on the board key.
+    """
+    board = boards.setdefault(key, {})
+    scores = ranked.setdefault(key, [])
+    if handle in board:
+        old = board[handle]
+        if old[:2] <= entry[:2]:
+            return
+        del scores[bisect_left(scores, (old[0], old[1], handle))]
+    board[handle] = entry
+    insort(scores, (entry[0], entry[1], handle))
+
+
+def race_dict(board, rank, handle):
+    score, game_id, name, time = board[handle]
+    return {
+        "rank": rank,
+        "game_id": game_id,
+        "handle": handle,
+        "name": name,
+        "score": score,
+        "when": time,
+    }
+
+
+def top(map_, endurance=False, number=None):
+    """
+    Return the best races on map_, one per handle.
+    """
+    board = boards.get((map_, endurance), {})
+    return [race_dict(board, i + 1, handle) for i, (score, game_id, handle)
+            in enumerate(ranked.get((map_, endurance), [])[:number])]
+
+
+def best(map_, handle, endurance=False):
+    """
+    Return the best race of handle on map_ with its rank, or None.
+    """
+    board = boards.get((map_, endurance), {})
+    if handle not in board:
+        return None
+    score, game_id = board[handle][:2]
+    return race_dict(board, bisect_left(ranked[(map_, endurance)],
+                                        (score, game_id, handle)) + 1, handle)
+
+
+def load_boards(state):
+    boards.clear()
+    ranked.clear()
+    for key in state:
+        boards[key] = state[key]
+        ranked[key] = sorted((e[0], e[1], h) for h, e in state[key].items())
+
+
+@indexes.index('leaderboards', lambda: boards, load_boards)
+def build_boards(first, last):
+    """
+    Add the completed timed races of games first to last to the boards.
+    """
+    from .database.models import Game, GamePlayer
+    racemodes = set(vclass.modes['race'] for vclass in versions.registry)
+    for r in (GamePlayer.query.join(Game)
+              .with_entities(GamePlayer.game_id, GamePlayer.handle,
+                             GamePlayer.name, GamePlayer.score,
+                             Game.time, Game.map, Game.mode, Game.mutators)
+              .filter(GamePlayer.game_id >= first, GamePlayer.game_id <= last)
+              .filter(Game.mode.in_(racemodes))
+              # Scores of 0 indicate the race was never completed.
+              .filter(GamePlayer.score > 0)):
+        game_id, handle, name, score, time, map_, mode, mutators = r
+        vclass = versions.cached_game_version(game_id)
+        if vclass is None or mode != vclass.modes['race']:
+            continue
+        muts = vclass.mutslist(mode, mutators)
+        # Only timed race, no freestyle.
+        if 'timed' not in muts or 'freestyle' in muts:
+            continue
+        entry = (score, game_id, name, time)
+        add((map_, False), handle, entry)
+        if 'endurance' in muts:
+            add((map_, True), handle, entry)
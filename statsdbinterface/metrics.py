@@ -0,0 +1,123 @@
+import time
+from threading import Lock
+from flask import Response, g, has_app_context, request
+from .database.core import db, db_function_calls
+from . import function_cache
+
+# Upper bounds of the request latency histogram buckets, in seconds.
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# <endpoint>: [<bucket counts>, <sum>, <count>]
+latency = {}
+# <endpoint>: [<statements>, <seconds>]
+queries = {}
+metrics_lock = Lock()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.time() - conn.info['query_start'].pop()
+    if has_app_context() and 'request_start' in g:
+        g.request_queries += 1
+        g.request_query_time += elapsed
+
+
+def start_request():
+    g.request_start = time.time()
+    g.request_queries = 0
+    g.request_query_time = 0
+
+
+def finish_request(exc):
+    if 'request_start' not in g:
+        return
+    elapsed = time.time() - g.request_start
+    endpoint = request.endpoint or "none"
+    with metrics_lock:
+        if endpoint not in latency:
+            latency[endpoint] = [[0] * len(buckets), 0, 0]
+            queries[endpoint] = [0, 0]
+        for i, bound in enumerate(buckets):
+            if elapsed <= bound:
+                latency[endpoint][0][i] += 1
+        latency[endpoint][1] += elapsed
+        latency[endpoint][2] += 1
+        queries[endpoint][0] += g.request_queries
+        queries[endpoint][1] += g.request_query_time
+
+
+def label(value):
+    return '"%s"' % (str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+
+
+def prometheus_text():
+    """
+    Return all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append("%s%s{%s} %s" % (name, suffix, ",".join(
+                "%s=%s" % (k, label(v)) for k, v in labels), repr(value)))
+
+    with metrics_lock:
+        samples = []
+        for endpoint in sorted(latency):
+            counts, total, count = latency[endpoint]
+            for bound, n in zip(buckets, counts):
+                samples.append(("_bucket", [("endpoint", endpoint),
+                                            ("le", float(bound))], n))
+            samples.append(("_bucket", [("endpoint", endpoint),
+                                        ("le", "+Inf")], count))
+            samples.append(("_sum", [("endpoint", endpoint)], total))
+            samples.append(("_count", [("endpoint", endpoint)], count))
+        metric("statsdb_request_duration_seconds", "histogram",
+               "Request latency by endpoint.", samples)
+        metric("statsdb_sql_statements_total", "counter",
+               "SQL statements executed by endpoint.",
+               [("", [("endpoint", e)], queries[e][0])
+                for e in sorted(queries)])
+        metric("statsdb_sql_seconds_total", "counter",
+               "Time spent executing SQL by endpoint.",
+               [("", [("endpoint", e)], queries[e][1])
+                for e in sorted(queries)])
+
+    metric("statsdb_db_function_calls_total", "counter",
+           "Calls of SQL functions implemented in Python.",
+           [("", [("function", f)], n)
+            for f, n in sorted(db_function_calls.items())])
+
+    with function_cache.cache_lock:
+        stats = sorted(function_cache.stats.items())
+    for i, (name, description) in enumerate([
+            ("hits", "Cached function calls answered from the cache."),
+            ("misses", "Cached function calls which had to be computed."),
+            ("evictions", "Expired entries removed from the cache.")]):
+        metric("statsdb_cache_%s_total" % name, "counter", description,
+               [("", [("function", f)], s[i]) for f, s in stats])
+
+    return "\n".join(lines) + "\n"
+
+
+def setup(app):
+    """
+    Record metrics for every request and serve them on /metrics.
+    """
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        db.event.listen(db.engine, 'after_cursor_execute',
+                        after_cursor_execute)
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(
+        prometheus_text(), mimetype='text/plain; version=0.0.4'))
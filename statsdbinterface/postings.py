@@ -0,0 +1,233 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from . import indexes
+from .redeclipse import versions
+
+# Ascending ids of the games of each player, server, map, mode, mutator and
+# version.
+# <(kind, key)>: array('I', [<game id>, ...])
+lists = {}
+# Ascending ids of all games and their times.
+games = array('I')
+times = array('l')
+# The latest time up to each game and the earliest time from each game on,
+# times can go back between games.
+maxtimes = array('l')
+mintimes = array('l')
+empty = array('I')
+# Kinds of lists which can be searched by.
+search_kinds = ["player", "server", "map", "mode", "mutator", "version"]
+
+
+def add(kind, key, game_id):
+    ids = lists.get((kind, key))
+    if ids is None:
+        ids = lists[(kind, key)] = array('I')
+    # A handle can appear more than once in a game.
+    if not ids or ids[-1] != game_id:
+        ids.append(game_id)
+
+
+def game_ids(kind, key):
+    """
+    Return the ascending game ids of key, don't modify them.
+    """
+    return lists.get((kind, key), empty)
+
+
+def contains(kind, key, game_id):
+    """
+    Return True if game_id is in the game ids of key.
+    """
+    ids = game_ids(kind, key)
+    i = bisect_left(ids, game_id)
+    return i < len(ids) and ids[i] == game_id
+
+
+def intersect(a, b):
+    """
+    Return the game ids in both a and b.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    ret = array('I')
+    lo = 0
+    for game_id in a:
+        lo = bisect_left(b, game_id, lo)
+        if lo == len(b):
+            break
+        if b[lo] == game_id:
+            ret.append(game_id)
+    return ret
+
+
+def window_span(since=None, until=None):
+    """
+    Return the smallest range of indexes in games containing every game
+    played between since and until.
+
+    Times can go back between games, so the range can contain games played
+    outside the window as well.
+    """
+    lo = bisect_left(maxtimes, since) if since is not None else 0
+    hi = (bisect_right(mintimes, until) if until is not None
+          else len(games))
+    return lo, max(lo, hi)
+
+
+def window(since=None, until=None):
+    """
+    Return the first and last ids of the range of games of window_span,
+    first is greater than last if it is empty.
+    """
+    lo, hi = window_span(since, until)
+    if lo == hi:
+        first = games[lo] if lo < len(games) else (
+            games[-1] + 1 if games else 1)
+        return first, first - 1
+    return games[lo], games[hi - 1]
+
+
+def search_filters(args):
+    """
+    Return the (kind, key) filters of the search arguments in args, each
+    can be given more than once.
+    """
+    return [(kind, key) for kind in search_kinds
+            for key in args.getlist(kind) if key]
+
+
+def search(filters, since=None, until=None):
+    """
+    Return the ascending ids of the games in the lists of all (kind, key)
+    in filters, played between since and until.
+    """
+    candidates = sorted([game_ids(kind, key) for kind, key in filters],
+                        key=len)
+    ret = candidates[0] if candidates else games
+    for ids in candidates[1:]:
+        if not ret:
+            break
+        ret = intersect(ret, ids)
+    if since is None and until is None:
+        return ret
+    lo, hi = window_span(since, until)
+    since = since if since is not None else float("-inf")
+    until = until if until is not None else float("inf")
+    if ret is games:
+        return array('I', (games[i] for i in range(lo, hi)
+                           if since <= times[i] <= until))
+    if lo == hi:
+        return array('I')
+    ret = ret[bisect_left(ret, games[lo]):bisect_right(ret, games[hi - 1])]
+    return array('I', (game_id for game_id in ret
+                       if since <= times[bisect_left(games, game_id, lo, hi)]
+                       <= until))
+
+
+def counts(kind, first, last, within=None):
+    """
+    Return {<key>: <games>} of the keys of kind with games from first to
+    last, only counting the games in within if it is given.
+    """
+    if within is not None:
+        within = within[bisect_left(within, first):
+                        bisect_right(within, last)]
+    ret = {}
+    for (k, key), ids in lists.items():
+        if k != kind:
+            continue
+        if within is None:
+            n = bisect_right(ids, last) - bisect_left(ids, first)
+        else:
+            n = len(intersect(within, ids))
+        if n:
+            ret[key] = n
+    return ret
+
+
+def keys(kind):
+    """
+    Return the keys of kind, newest first by their first game.
+    """
+    return sorted((k for t, k in lists if t == kind),
+                  key=lambda k: lists[(kind, k)][0], reverse=True)
+
+
+def mode_keys(game_id, mode, mutators):
+    """
+    Return the mode and mutator keys of a game, None and no mutators if its
+    version is unknown.
+    """
+    vclass = versions.cached_game_version(game_id)
+    if vclass is None or mode not in vclass.cmodestr:
+        return None, []
+    modename = vclass.cmodestr[mode]
+    # Game specific mutators are named after their mode.
+    return modename, [mut if mut in vclass.basemuts else
+                      "%s-%s" % (modename, mut)
+                      for mut in vclass.mutslist(mode, mutators)]
+
+
+def dump_lists():
+    return {
+        "lists": lists,
+        "games": games,
+        "times": times,
+        "maxtimes": maxtimes,
+        "mintimes": mintimes,
+    }
+
+
+def load_lists(state):
+    lists.clear()
+    lists.update(state["lists"])
+    games[:] = state["games"]
+    times[:] = state["times"]
+    maxtimes[:] = state["maxtimes"]
+    mintimes[:] = state["mintimes"]
+
+
+@indexes.index('postings', dump_lists, load_lists)
+def build_lists(first, last):
+    """
+    Append games first to last to the lists.
+    """
+    from .database.models import Game, GamePlayer, GameServer
+    # Read everything before changing the lists.
+    new_games = (
+        Game.query.with_entities(Game.id, Game.time, Game.map, Game.mode,
+                                 Game.mutators)
+        .filter(Game.id >= first, Game.id <= last)
+        .order_by(Game.id).all())
+    new_servers = (
+        GameServer.query.with_entities(GameServer.game_id, GameServer.handle,
+                                       GameServer.version)
+        .filter(GameServer.game_id >= first, GameServer.game_id <= last)
+        .order_by(GameServer.game_id).all())
+    new_players = (
+        GamePlayer.query.with_entities(GamePlayer.game_id, GamePlayer.handle)
+        .filter(GamePlayer.game_id >= first, GamePlayer.game_id <= last)
+        .filter(GamePlayer.handle != '')
+        .order_by(GamePlayer.game_id).all())
+    for game_id, time, map_, mode, mutators in new_games:
+        games.append(game_id)
+        times.append(time)
+        maxtimes.append(max(time, maxtimes[-1]) if maxtimes else time)
+        mintimes.append(time)
+        i = len(mintimes) - 2
+        while i >= 0 and mintimes[i] > time:
+            mintimes[i] = time
+            i -= 1
+        add('map', map_, game_id)
+        modename, mutnames = mode_keys(game_id, mode, mutators)
+        if modename is not None:
+            add('mode', modename, game_id)
+        for mutname in mutnames:
+            add('mutator', mutname, game_id)
+    for game_id, handle, version in new_servers:
+        if handle:
+            add('server', handle, game_id)
+        add('version', version, game_id)
+    for game_id, handle in new_players:
+        add('player', handle, game_id)
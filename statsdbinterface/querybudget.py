@@ -0,0 +1,99 @@
+from flask import current_app, g, has_app_context, request
+from werkzeug.exceptions import InternalServerError
+from .database.core import db, db_function_calls
+
+
+def budget(queries):
+    """
+    Decorator, declares the maximum number of SQL statements a view may
+    execute. It must not depend on the amount of data in the database.
+    """
+    def wrapper(f):
+        f.query_budget = queries
+        return f
+
+    return wrapper
+
+
+def view_budget(app, endpoint):
+    """
+    Return the query budget of the view of endpoint, or None.
+    """
+    return getattr(app.view_functions.get(endpoint), 'query_budget', None)
+
+
+class QueryCounter:
+    """
+    Context manager, counts the SQL statements and calls of SQL functions
+    implemented in Python of all threads inside the block.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.udf_calls = 0
+
+    def before_cursor_execute(self, *args):
+        self.queries += 1
+
+    def __enter__(self):
+        self.queries = 0
+        self.udf_start = sum(db_function_calls.values())
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        db.event.remove(db.engine, 'before_cursor_execute',
+                        self.before_cursor_execute)
+        self.udf_calls = sum(db_function_calls.values()) - self.udf_start
+
+
+class QueryBudgetExceeded(InternalServerError):
+    pass
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_app_context() and 'budget_queries' in g:
+        g.budget_queries += 1
+
+
+def start_request():
+    g.budget_queries = 0
+
+
+def over_budget(path, endpoint, queries):
+    """
+    Return a QueryBudgetExceeded if queries is over the budget of the view
+    of endpoint, otherwise None.
+    """
+    limit = view_budget(current_app, endpoint)
+    if limit is None or queries <= limit:
+        return None
+    current_app.logger.error("%s: %d SQL statements, the budget is %d",
+                             path, queries, limit)
+    return QueryBudgetExceeded(
+        "%s executed %d SQL statements, the budget is %d." % (
+            path, queries, limit))
+
+
+def finish_request(response):
+    if 'budget_queries' not in g:
+        return response
+    error = over_budget(request.path, request.endpoint, g.budget_queries)
+    if error is not None:
+        # Replace the response, raising here would bypass the error pages.
+        return current_app.make_response(
+            current_app.handle_http_exception(error))
+    return response
+
+
+def setup(app):
+    """
+    Fail every request which executes more SQL statements than the budget
+    of its view.
+    """
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(finish_request)
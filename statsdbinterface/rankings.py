@@ -2,39 +2,98 @@ import time
 from .database import models, extmodels
 from .database.core import db
 from .function_cache import cached
-from . import redeclipse
+from . import postings, redeclipse
+
+# <name>: <ranking function of a scope>, served by /api/rankings/<name>.
+registry = {}
 
 
 def days_ago(days):
     return time.time() - (days * 60 * 60 * 24)
 
 
-@cached(60)
+def ranking(f):
+    """
+    Decorator, registers a ranking.
+    """
+    registry[f.__name__] = f
+    return f
+
+
 def first_game_in_days(days):
-    return (
-        (models.Game.query
-         .with_entities(db.func.min(models.Game.id))
-         .filter(models.Game.time >= days_ago(days))).scalar() or
-        (models.Game.query
-         .with_entities(db.func.max(models.Game.id)).scalar() + 1)
-        )
+    return postings.window(days_ago(days))[0]
+
+
+def window_scope(since=None, until=None, mode=None, mutator=None):
+    """
+    Return the first and last game ids between since and until with the
+    mode and mutator to filter by. Rankings are computed and cached by
+    scope, so windows containing the same games share their results.
+    """
+    return postings.window(since, until) + (mode, mutator)
+
+
+def last_days(days):
+    """
+    Return the scope of the last <days> days.
+    """
+    return window_scope(days_ago(days))
+
+
+def scope_filters(game_id, scope):
+    """
+    Return the filters on the game_id column selecting the games of scope.
+    """
+    first, last, mode, mutator = scope
+    ret = [game_id >= first, game_id <= last]
+    if mode is not None:
+        ret.append(db.func.re_mode(game_id, mode))
+    if mutator is not None:
+        if '-' in mutator:
+            mode, mutator = mutator.split('-')
+            ret.append(db.func.re_mode(game_id, mode))
+        ret.append(db.func.re_mut(game_id, mutator))
+    return ret
+
 
+def scope_counts(kind, scope):
+    """
+    Return {<key>: <games>} of the keys of kind with games in scope, counted
+    in the postings.
+    """
+    first, last, mode, mutator = scope
+    within = None
+    for k, key in (('mode', mode), ('mutator', mutator)):
+        if key is not None:
+            ids = postings.game_ids(k, key)
+            within = ids if within is None else postings.intersect(within, ids)
+    return postings.counts(kind, first, last, within)
+
+
+def by_games(counts, name="handle"):
+    """
+    Return the keys of counts with their games, most games first.
+    """
+    return [{name: key, "games": counts[key]}
+            for key in sorted(sorted(counts), key=lambda k: counts[k],
+                              reverse=True)]
 
-def weapon_sums(days, use_totalwielded=True):
-    first_game = first_game_in_days(days)
+
+def weapon_sums(scope, use_totalwielded=True):
     totalwielded = 0
     if use_totalwielded:
         totalwielded = (models.GameWeapon.query
                         .with_entities(db.func.sum(
                             models.GameWeapon.timewielded))
-                        .filter(models.GameWeapon.game_id >= first_game)
+                        .filter(*scope_filters(models.GameWeapon.game_id,
+                                               scope))
                         .filter(db.func.re_normal_weapons(
                             models.GameWeapon.game_id))
                         .filter(models.GameWeapon.weapon.in_(
                             redeclipse.versions.default.standardweaponlist))
                         .first()[0])
     weapons = extmodels.Weapon.all_from_f((
-        models.GameWeapon.game_id >= first_game,
+        *scope_filters(models.GameWeapon.game_id, scope),
         db.func.re_normal_weapons(models.GameWeapon.game_id),
         models.GameWeapon.weapon.in_(
             redeclipse.versions.default.standardweaponlist)))
@@ -44,25 +103,27 @@ def weapon_sums(days, use_totalwielded=True):
          }
 
 
+@ranking
 @cached(15 * 60)
-def weapons_by_wielded(days):
+def weapons_by_wielded(scope):
     """
     Return weapons sorted by wielded ratio.
     Cache can be high, result will not change quickly.
     """
-    res = weapon_sums(days)
+    res = weapon_sums(scope)
     ret = sorted(res["weapons"], key=lambda w: w.timewielded, reverse=True)
     return [{"name": w.name, "timewielded":
              w.timewielded / max(1, res["totalwielded"])} for w in ret]
 
 
+@ranking
 @cached(15 * 60)
-def weapons_by_dpm(days):
+def weapons_by_dpm(scope):
     """
     Return weapons sorted by DPM.
     Cache can be high, result will not change quickly.
     """
-    res = weapon_sums(days, False)
+    res = weapon_sums(scope, False)
     mintime = sum([w.time() for w in res["weapons"]]) / len(res["weapons"]) / 4
     ret = sorted([w for w in res["weapons"] if w.time() >= mintime],
                  key=lambda w: (w.damage1 + w.damage2) /
@@ -71,118 +132,81 @@ def weapons_by_dpm(days):
              (max(1, w.time()) / 60)} for w in ret]
 
 
+@ranking
 @cached(60 * 3)
-def maps_by_playertime(days):
+def maps_by_playertime(scope):
     """
     Return maps sorted by their player time.
     Cache should be low, result could change quickly.
     """
-    first_game = first_game_in_days(days)
-    maps = [r[0] for r in models.Game.query
-            .with_entities(models.Game.map)
-            .filter(models.Game.time >= days_ago(days))]
+    games = scope_counts('map', scope)
+    times = dict(models.GamePlayer.query
+                 .join(models.Game)
+                 .with_entities(models.Game.map,
+                                db.func.sum(models.GamePlayer.timeactive))
+                 .filter(*scope_filters(models.GamePlayer.game_id, scope))
+                 .group_by(models.Game.map))
     ret = []
-    for map_ in set(maps):
+    for map_ in sorted(games):
         ret.append({
             "name": map_,
-            "time": (models.GamePlayer.query
-                     .join(models.Game)
-                     .with_entities(db.func.sum(models.GamePlayer.timeactive))
-                     .filter(models.GamePlayer.game_id >= first_game)
-                     .filter(models.Game.map == map_)
-                     .first()[0]),
-            "games": maps.count(map_),
+            "time": times.get(map_),
+            "games": games[map_],
             })
     return sorted(ret, key=lambda m: m['time'], reverse=True)
 
 
+@ranking
 @cached(60)
-def players_by_games(days):
-    first_game = first_game_in_days(days)
-    players = [r[0] for r in models.GamePlayer.query
-               .with_entities(models.GamePlayer.handle)
-               .filter(models.GamePlayer.game_id >= first_game)
-               .filter(models.GamePlayer.handle != "")]
-    ret = []
-    for player in set(players):
-        ret.append({
-            "handle": player,
-            "games": players.count(player),
-            })
-    return sorted(ret, key=lambda p: p['games'], reverse=True)
+def players_by_games(scope):
+    return by_games(scope_counts('player', scope))
 
 
+@ranking
 @cached(60)
-def modes_by_games(days):
+def modes_by_games(scope):
     re = redeclipse.versions.default
-    first_game = first_game_in_days(days)
-    modes = extmodels.Mode.mode_list()
+    counts = scope_counts('mode', scope)
     ret = []
-    for mode in modes:
-        m = {
+    for mode in extmodels.Mode.mode_list():
+        ret.append({
             'name': mode,
             'longname': re.modestr[re.modes[mode]],
-            'games': 0,
-            }
-        m['games'] = models.Game.query.filter(
-            db.func.re_mode(models.Game.id, mode),
-            models.Game.id >= first_game
-            ).count()
-        ret.append(m)
+            'games': counts.get(mode, 0),
+            })
     return sorted(ret, key=lambda m: m['games'], reverse=True)
 
 
+@ranking
 @cached(60)
-def mutators_by_games(days):
-    first_game = first_game_in_days(days)
-    mutators = extmodels.Mutator.mutator_list()
+def mutators_by_games(scope):
+    # Game specific mutators are counted under their mode, like on their
+    # pages.
+    counts = scope_counts('mutator', scope)
     ret = []
-    for mutator in mutators:
-        m = {
+    for mutator in extmodels.Mutator.mutator_list():
+        ret.append({
             'name': mutator,
             'link': mutator,
             'longname': mutator,
-            'games': 0,
-            }
-        if '-' in mutator:
-            mode, mut = mutator.split('-')
-            m['games'] = models.Game.query.filter(
-                db.func.re_mode(models.Game.id, mode),
-                db.func.re_mut(models.Game.id, mut),
-                models.Game.id >= first_game
-                ).count()
-        else:
-            m['games'] = models.Game.query.filter(
-                db.func.re_mut(models.Game.id, mutator),
-                models.Game.id >= first_game
-                ).count()
-        ret.append(m)
+            'games': counts.get(mutator, 0),
+            })
     return sorted(ret, key=lambda m: m['games'], reverse=True)
 
 
+@ranking
 @cached(60)
-def servers_by_games(days):
-    first_game = first_game_in_days(days)
-    servers = [r[0] for r in models.GameServer.query
-               .with_entities(models.GameServer.handle)
-               .filter(models.GameServer.game_id >= first_game)
-               .filter(models.GameServer.handle != "")]
-    ret = []
-    for server in set(servers):
-        ret.append({
-            "handle": server,
-            "games": servers.count(server),
-            })
-    return sorted(ret, key=lambda p: p['games'], reverse=True)
+def servers_by_games(scope):
+    return by_games(scope_counts('server', scope))
 
 
+@ranking
 @cached(60)
-def players_by_kdr(days):
-    first_game = first_game_in_days(days)
+def players_by_kdr(scope):
     ret = {}
     games = {}
     for player in (models.GamePlayer.query.join(models.Game)
-                   .filter(models.GamePlayer.game_id >= first_game)
+                   .filter(*scope_filters(models.GamePlayer.game_id, scope))
                    .filter(models.GamePlayer.handle != "")
                    .filter(models.Game.uniqueplayers > 1)):
         if player.handle not in ret:
@@ -195,6 +219,8 @@ def players_by_kdr(days):
         games[player.handle] += 1
         ret[player.handle]["frags"] += player.frags
         ret[player.handle]["deaths"] += player.deaths
+    if not games:
+        return []
     # Only count players who have played >= half the average number of games.
     # This avoids small numbers of games from skewing the values.
     gamemin = min([sum(games.values()) / len(games) / 2, max(games.values())])
@@ -205,17 +231,17 @@ def players_by_kdr(days):
                                    reverse=True)]
 
 
+@ranking
 @cached(5 * 60)
-def players_by_dpm(days):
+def players_by_dpm(scope):
     """
     Return a sorted list of players with and by dpm.
     """
-    first_game = first_game_in_days(days)
     res_compiled = {}
     games = {}
     for player in (models.GamePlayer.query.join(models.Game)
                    .with_entities(models.GamePlayer.handle)
-                   .filter(models.GamePlayer.game_id >= first_game)
+                   .filter(*scope_filters(models.GamePlayer.game_id, scope))
                    .filter(models.GamePlayer.handle != "")
                    .filter(db.func.re_normal_weapons(
                        models.GamePlayer.game_id))
@@ -223,18 +249,20 @@ def players_by_dpm(days):
         if player.handle not in games:
             games[player.handle] = 0
         games[player.handle] += 1
+    sums = {r[0]: r[1:] for r in (
+        models.GameWeapon.query
+        .with_entities(models.GameWeapon.playerhandle,
+                       db.func.sum(models.GameWeapon.damage1),
+                       db.func.sum(models.GameWeapon.damage2),
+                       db.func.sum(models.GameWeapon.timewielded))
+        .filter(*scope_filters(models.GameWeapon.game_id, scope))
+        .filter(db.func.re_normal_weapons(models.GameWeapon.game_id))
+        .filter(~models.GameWeapon.weapon.in_(
+            redeclipse.versions.default.notwielded
+            ))
+        .group_by(models.GameWeapon.playerhandle))}
     for player in games.keys():
-        d1, d2, timewielded = (
-            models.GameWeapon.query
-            .with_entities(db.func.sum(models.GameWeapon.damage1),
-                           db.func.sum(models.GameWeapon.damage2),
-                           db.func.sum(models.GameWeapon.timewielded))
-            .filter(models.GameWeapon.playerhandle == player)
-            .filter(models.GameWeapon.game_id >= first_game)
-            .filter(db.func.re_normal_weapons(models.GameWeapon.game_id))
-            .filter(~models.GameWeapon.weapon.in_(
-                redeclipse.versions.default.notwielded
-                ))).first()
+        d1, d2, timewielded = sums.get(player, (0, 0, 0))
         res_compiled[player] = {
             "handle": player,
             "dpm": (((d1 or 0) + (d2 or 0)) / (max(timewielded or 0, 1) / 60)),
@@ -250,14 +278,14 @@ def players_by_dpm(days):
                                             reverse=True)]
 
 
+@ranking
 @cached(10 * 60)
-def player_weapons(days):
+def player_weapons(scope):
     """
     Return a sorted list of weapons and their best players with the most FPM.
     """
-    first_game = first_game_in_days(days)
     res = (models.GameWeapon.query
-           .filter(models.GameWeapon.game_id >= first_game)
+           .filter(*scope_filters(models.GameWeapon.game_id, scope))
            .filter(models.GameWeapon.playerhandle != "")
            .filter(db.func.re_normal_weapons(models.GameWeapon.game_id))
            .filter(models.GameWeapon.weapon.in_(
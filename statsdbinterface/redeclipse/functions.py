@@ -1,4 +1,5 @@
-from ..database.core import db_function, db
+from ..database.core import db_function
+from .. import indexes
 from . import versions
 
 
@@ -17,6 +18,9 @@ def re_normal_weapons(game_id):
             ret = False
             break
     re_normal_weapons.cache[game_id] = ret
+    return ret
+
+
 re_normal_weapons.cache = {}
 
 
@@ -65,45 +69,55 @@ def re_mut(game_id, mut):
 
 re_mut.cache = {}
 re_mut.precache = {}
-re_mode.lastprecache = 0
+re_mut.lastprecache = 0
 
 
 @db_function('re_ver')
 def re_ver(version, vmin, vmax):
-    vmin = versions.version_str_to_tuple(vmin)
-    vmax = versions.version_str_to_tuple(vmax)
-    v = versions.version_str_to_tuple(version)
+    key = (version, vmin, vmax)
+    if key not in re_ver.cache:
+        re_ver.cache[key] = (versions.version_str_to_tuple(vmin) <=
+                             versions.version_str_to_tuple(version) <=
+                             versions.version_str_to_tuple(vmax))
+    return re_ver.cache[key]
+
+
+re_ver.cache = {}
 
-    return vmin <= v <= vmax
 
+def dump_precache():
+    return {
+        "modes": re_mode.precache,
+        "mutators": re_mut.precache,
+        "last": re_mode.lastprecache,
+    }
 
-def build_precache():
+
+def load_precache(state):
+    re_mode.precache = state["modes"]
+    re_mut.precache = state["mutators"]
+    re_mut.lastprecache = re_mode.lastprecache = state["last"]
+
+
+@indexes.index('functions', dump_precache, load_precache)
+def build_precache(first, last):
     """
-    Build a precache of games before the current run.
+    Add games first to last to the precache.
     """
-    from ..database.models import Game, GameServer
-    re_mut.lastprecache = re_mode.lastprecache = Game.query.with_entities(
-        db.func.max(Game.id)).first()[0]
+    from ..database.models import Game
     for vclass in versions.registry:
         for mode in vclass.modes:
-            if mode not in re_mode.precache:
-                re_mode.precache[mode] = []
-            re_mode.precache[mode] += [
-                r[0] for r in
-                Game.query.with_entities(Game.id)
-                .join(Game.server)
-                .filter(db.func.re_ver(GameServer.version, vclass.startstr,
-                                       vclass.endstr))
-                .filter(Game.mode == vclass.modes[mode]).all()
-            ]
+            re_mode.precache.setdefault(mode, set())
         for mut in vclass.mutators:
-            if mut not in re_mut.precache:
-                re_mut.precache[mut] = []
-            re_mut.precache[mut] += [
-                r[0] for r in
-                Game.query.with_entities(Game.id)
-                .join(Game.server)
-                .filter(db.func.re_ver(GameServer.version, vclass.startstr,
-                                       vclass.endstr))
-                .filter(Game.mutators.op('&')(vclass.mutators[mut])).all()
-            ]
+            re_mut.precache.setdefault(mut, set())
+    for game_id, mode, mutators in (
+            Game.query.with_entities(Game.id, Game.mode, Game.mutators)
+            .filter(Game.id >= first, Game.id <= last)):
+        vclass = versions.cached_game_version(game_id)
+        if vclass is None:
+            continue
+        if mode in vclass.cmodestr:
+            re_mode.precache[vclass.cmodestr[mode]].add(game_id)
+        for mut in vclass.mutslist(mode, mutators):
+            re_mut.precache[mut].add(game_id)
+    re_mut.lastprecache = re_mode.lastprecache = last
@@ -1,16 +1,21 @@
-from ..database.core import db
+from array import array
 from collections import OrderedDict
+from .. import indexes
 
 
 DEFAULT_VERSION = "1.5.6"
 
 registry = []
-game_cache = {}
+# Index of each game's version class in registry, by game id, -1 if unknown.
+game_cache = array('b')
 version_cache = {}
+tuple_cache = {}
 
 
 def version_str_to_tuple(s):
-    return tuple([int(n) for n in s.split('.')])
+    if s not in tuple_cache:
+        tuple_cache[s] = tuple([int(n) for n in s.split('.')])
+    return tuple_cache[s]
 
 
 def get_version_class(version):
@@ -33,26 +38,56 @@ def get_version_class(version):
         DEFAULT_VERSION))
 
 
-def get_game_version(game_id):
-    from ..database.models import Game
-    if game_id not in game_cache:
-        game_cache[game_id] = Game.query.filter(
-            Game.id == game_id).first().server[0].version
-    return get_version_class(game_cache[game_id])
+def cache_game_version(game_id, version):
+    if game_id >= len(game_cache):
+        game_cache.extend(array('b', [-1]) * (game_id + 1 - len(game_cache)))
+    game_cache[game_id] = get_version_class(version).index
+
+
+def cached_game_version(game_id):
+    """
+    Return the version class of game_id if it is cached, otherwise None.
+    """
+    if game_id < len(game_cache) and game_cache[game_id] >= 0:
+        return registry[game_cache[game_id]]
+    return None
 
 
-def build_precache():
+def get_game_version(game_id):
+    from ..database.models import Game
+    vclass = cached_game_version(game_id)
+    if vclass is None:
+        server = Game.query.filter(Game.id == game_id).first().server.first()
+        if server is None:
+            # Without a server row the version is unknown, use the default
+            # like for unknown versions but don't cache it, the row can
+            # still be added.
+            return get_version_class(DEFAULT_VERSION)
+        cache_game_version(game_id, server.version)
+        vclass = registry[game_cache[game_id]]
+    return vclass
+
+
+def load_precache(state):
+    game_cache[:] = state
+
+
+@indexes.index('versions', lambda: game_cache, load_precache)
+def build_precache(first, last):
+    """
+    Cache the version of games first to last.
+    """
     from ..database.models import Game, GameServer
-    for vclass in registry:
-        for r in (Game.query.with_entities(Game.id)
-                  .join(Game.server)
-                  .filter(db.func.re_ver(GameServer.version, vclass.startstr,
-                                         vclass.endstr)).all()):
-                        game_cache[r[0]] = vclass.startstr
+    for r in (Game.query.with_entities(Game.id, GameServer.version)
+              .join(Game.server)
+              .filter(Game.id >= first, Game.id <= last).all()):
+        cache_game_version(r[0], r[1])
 
 
 def reversion(c):
-    registry.append(c())
+    vclass = c()
+    vclass.index = len(registry)
+    registry.append(vclass)
     return c
 
 
@@ -94,31 +129,51 @@ class RE:
                     self.shortmutators[mutator] = shortened
                     break
 
+        # Create mutator decoding tables, (name, bit) pairs for each mode.
+        self.basemuttable = tuple(self.basemuts.items())
+        self.muttables = {}
+        for mode in self.cmodestr:
+            self.muttables[mode] = self.basemuttable + tuple(
+                self.gspmuts.get(mode, {}).items())
+        # Decoded mutators, by (mode, mutators, short).
+        self.mutslist_cache = {}
+        self.mutdicts_cache = {}
+
         self.startstr = self.start
         self.start = version_str_to_tuple(self.start)
         self.endstr = self.end
         self.end = version_str_to_tuple(self.end)
 
     def mutslist(self, mode, mutators, short=False):
-        muts = []
-
-        def chunks(l, n):
-            for i in range(0, len(l), n):
-                yield l[i:i + n]
-
-        for m in self.basemuts:
-            if mutators & self.basemuts[m]:
-                muts.append(m)
-
-        if mode in self.gspmuts:
-            for m in self.gspmuts[mode]:
-                if mutators & self.gspmuts[mode][m]:
-                    muts.append(m)
-
-        if short:
-            muts = [self.shortmutators[m] for m in muts]
-
-        return muts
+        key = (mode, mutators, short)
+        if key not in self.mutslist_cache:
+            muts = tuple(m for m, bit in
+                         self.muttables.get(mode, self.basemuttable)
+                         if mutators & bit)
+            if short:
+                muts = tuple(self.shortmutators[m] for m in muts)
+            self.mutslist_cache[key] = muts
+        return self.mutslist_cache[key]
+
+    def mutator_dicts(self, mode, mutators, short=False):
+        """
+        Return the mutators for display, gamespecific ones link to mode.
+
+        The result is shared between callers and must not be modified.
+        """
+        key = (mode, mutators, short)
+        if key not in self.mutdicts_cache:
+            ret = []
+            for m in self.mutslist(mode, mutators):
+                ret.append({
+                    "link": (m if m in self.basemuts else
+                             self.cmodestr[mode] + '-' + m),
+                    "name": self.shortmutators[m] if short else m,
+                    "longname": m,
+                    "shortname": self.shortmutators[m],
+                    })
+            self.mutdicts_cache[key] = tuple(ret)
+        return self.mutdicts_cache[key]
 
 
 @reversion
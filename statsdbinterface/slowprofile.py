@@ -0,0 +1,132 @@
+import os
+import re
+import sys
+import time
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from flask import Response, current_app, g, request
+
+# Seconds between two samples of the stacks of the profiled requests.
+INTERVAL = 0.005
+
+# <thread id>: Counter of <collapsed stack>: <samples>
+active = {}
+active_lock = Lock()
+# Set while there are requests to sample.
+sampling = Event()
+sampler_thread = None
+profile_dir = None
+
+
+def collapse(frame):
+    """
+    Return the stack of frame in the collapsed format of flamegraph.pl,
+    outermost call first.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("%s (%s:%d)" % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sampler():
+    while True:
+        sampling.wait()
+        time.sleep(INTERVAL)
+        frames = sys._current_frames()
+        with active_lock:
+            for ident, stacks in active.items():
+                if ident in frames:
+                    stacks[collapse(frames[ident])] += 1
+
+
+def requested():
+    """
+    Return True if an admin asked for the profile of this request.
+    """
+    return (request.args.get("profile") == "1" and
+            request.remote_addr in current_app.config['PROFILE_ADMINS'])
+
+
+def start_request():
+    if current_app.config['PROFILE_SLOW_REQUESTS'] is None and not requested():
+        return
+    g.profile_start = time.time()
+    with active_lock:
+        active[get_ident()] = Counter()
+        sampling.set()
+
+
+def stop_sampling():
+    with active_lock:
+        stacks = active.pop(get_ident(), None)
+        if not active:
+            sampling.clear()
+    return stacks
+
+
+def write(elapsed, stacks):
+    """
+    Write stacks to the profile directory, named by the request, and remove
+    the oldest profiles over PROFILE_KEEP.
+    """
+    name = "%s-%dms-%s" % (
+        time.strftime("%Y%m%d-%H%M%S"), elapsed * 1000,
+        re.sub(r"[^\w.:=-]+", "_", request.full_path.strip("?"))[:150])
+    try:
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        with open(os.path.join(profile_dir, name + ".folded"), "w") as f:
+            for stack, samples in sorted(stacks.items()):
+                f.write("%s %d\n" % (stack, samples))
+        profiles = sorted(p for p in os.listdir(profile_dir)
+                          if p.endswith(".folded"))
+        for p in profiles[:-current_app.config['PROFILE_KEEP']]:
+            os.remove(os.path.join(profile_dir, p))
+    except OSError:
+        current_app.logger.exception("Could not write profile %s", name)
+
+
+def finish_request(response):
+    if 'profile_start' not in g:
+        return response
+    stacks = stop_sampling()
+    elapsed = time.time() - g.profile_start
+    threshold = current_app.config['PROFILE_SLOW_REQUESTS']
+    if threshold is not None and elapsed >= threshold:
+        current_app.logger.warning("%s: slow request, %.3fs", request.path,
+                                   elapsed)
+        write(elapsed, stacks)
+    if requested():
+        return Response("".join("%s %d\n" % (stack, samples)
+                                for stack, samples in sorted(stacks.items())),
+                        mimetype='text/plain')
+    return response
+
+
+def teardown_request(exc):
+    # Stop sampling requests which failed before finish_request.
+    if 'profile_start' in g:
+        stop_sampling()
+
+
+def setup(app, data_dir):
+    """
+    Sample the stacks of requests, writing the profiles of those slower than
+    PROFILE_SLOW_REQUESTS to PROFILE_DIR in data_dir.
+
+    ?profile=1 from an address in PROFILE_ADMINS returns the profile of the
+    request instead of the response.
+    """
+    global sampler_thread, profile_dir
+    profile_dir = os.path.join(data_dir, app.config['PROFILE_DIR'])
+    if sampler_thread is None:
+        sampler_thread = Thread(target=sampler, daemon=True)
+        sampler_thread.start()
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(teardown_request)
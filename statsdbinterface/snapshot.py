@@ -0,0 +1,85 @@
+import atexit
+import os
+import pickle
+from . import indexes
+
+# Increase whenever the state of an index changes format.
+SNAPSHOT_VERSION = 9
+
+
+def database_identity():
+    """
+    Return a value identifying the database, independent of its location.
+    """
+    from .database.models import Game
+    first = Game.query.order_by(Game.id.asc()).first()
+    if first is None:
+        return None
+    return (first.id, first.time, first.map)
+
+
+def load(path, identity):
+    """
+    Restore the indexes from the snapshot at path.
+
+    Return False if there is no usable snapshot for this database.
+    """
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False
+    names = [r[0] for r in indexes.registry]
+    if (snapshot.get('version') != SNAPSHOT_VERSION or
+            snapshot.get('identity') != identity or
+            sorted(snapshot.get('indexes', {})) != sorted(names) or
+            sorted(snapshot.get('lastgames', {})) != sorted(names) or
+            max(snapshot['lastgames'].values(), default=0) >
+            indexes.latest_game()):
+        return False
+    with indexes.update_lock:
+        for name, f, dump, load in indexes.registry:
+            load(snapshot['indexes'][name])
+        indexes.lastgames.clear()
+        indexes.lastgames.update(snapshot['lastgames'])
+    return True
+
+
+def save(path, identity):
+    """
+    Write the current state of the indexes to path.
+
+    Return False if the snapshot could not be written.
+    """
+    with indexes.update_lock:
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'identity': identity,
+            'lastgames': dict(indexes.lastgames),
+            'indexes': {name: dump()
+                        for name, f, dump, load in indexes.registry},
+        }
+        # Write to a temporary file first, a partial snapshot is useless.
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            return False
+    return True
+
+
+def setup(app, data_dir):
+    """
+    Build the indexes, resuming from the snapshot in data_dir if enabled.
+    """
+    with app.app_context():
+        if not app.config['CACHE_SNAPSHOT']:
+            indexes.update()
+            return
+        path = os.path.join(data_dir, app.config['CACHE_SNAPSHOT'])
+        identity = database_identity()
+        load(path, identity)
+        indexes.update()
+        save(path, identity)
+    atexit.register(save, path, identity)
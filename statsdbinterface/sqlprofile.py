@@ -0,0 +1,91 @@
+import re
+import time
+from flask import current_app, g, has_app_context, jsonify, request
+from .database.core import db
+
+# Literals and parameter lists, removed to get the shape of a statement.
+literals = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def shape(statement):
+    """
+    Return statement with literals and parameter lists normalized.
+    """
+    for pattern, replacement in literals:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('sqlprofile_start', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.time() - conn.info['sqlprofile_start'].pop()
+    if has_app_context() and 'sqlprofile' in g:
+        g.sqlprofile.append((statement, elapsed))
+
+
+def start_request():
+    g.sqlprofile = []
+
+
+def report(statements):
+    """
+    Return a summary of statements, repeated shapes are likely N+1 queries.
+    """
+    shapes = {}
+    for statement, elapsed in statements:
+        s = shape(statement)
+        if s not in shapes:
+            shapes[s] = {"shape": s, "count": 0, "time": 0}
+        shapes[s]["count"] += 1
+        shapes[s]["time"] += elapsed
+    threshold = current_app.config['SQL_PROFILE_REPEATED']
+    return {
+        "count": len(statements),
+        "time": sum(elapsed for statement, elapsed in statements),
+        "statements": [{"statement": statement, "time": elapsed}
+                       for statement, elapsed in statements],
+        "repeated": sorted([s for s in shapes.values()
+                            if s["count"] >= threshold],
+                           key=lambda s: s["count"], reverse=True),
+    }
+
+
+def finish_request(response):
+    if 'sqlprofile' not in g:
+        return response
+    ret = report(g.sqlprofile)
+    if request.args.get("sqlprofile") == "json":
+        response = jsonify(ret)
+    response.headers['X-Query-Count'] = str(ret["count"])
+    response.headers['X-Query-Time'] = "%.6f" % ret["time"]
+    response.headers['X-Query-Repeated'] = str(len(ret["repeated"]))
+    for s in ret["repeated"]:
+        current_app.logger.warning("%s: %d x %s", request.path,
+                                   s["count"], s["shape"])
+    return response
+
+
+def setup(app):
+    """
+    Profile the SQL statements of every request.
+
+    Responses get X-Query-Count, X-Query-Time and X-Query-Repeated headers,
+    ?sqlprofile=json replaces the response with the full profile.
+    """
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        db.event.listen(db.engine, 'after_cursor_execute',
+                        after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(finish_request)
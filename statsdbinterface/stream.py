@@ -0,0 +1,138 @@
+import datetime
+import json
+from collections import deque
+from threading import Lock
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue
+from tornado.web import Application, FallbackHandler, RequestHandler
+from tornado.wsgi import WSGIContainer
+from . import indexes, postings
+
+# Summaries of the latest games, oldest first, for resuming streams.
+# (<game id>, <summary json>)
+recent = deque(maxlen=1000)
+# Functions called with the summaries of each batch of new games.
+subscribers = set()
+lock = Lock()
+# Seconds after which an idle stream is sent a comment to keep it open.
+KEEPALIVE = 30
+
+
+def summary(game, server):
+    # The mode is None and there are no mutators if the version is unknown.
+    mode, mutators = postings.mode_keys(game.id, game.mode, game.mutators)
+    return {
+        "id": game.id,
+        "time": game.time,
+        "map": game.map,
+        "mode": mode,
+        "mutators": mutators,
+        "server": server,
+        "timeplayed": game.timeplayed,
+        "uniqueplayers": game.uniqueplayers,
+    }
+
+
+def load_recent(state):
+    recent.clear()
+    recent.extend(state)
+
+
+@indexes.index('stream', lambda: list(recent), load_recent)
+def build_recent(first, last):
+    """
+    Summarize the newest of games first to last and pass them to the
+    subscribers.
+    """
+    from .database.core import db
+    from .database.models import Game, GameServer
+    first = max(first, last - recent.maxlen + 1)
+    new = [(game.id, json.dumps(summary(game, server)))
+           for game, server in (
+               db.session.query(Game, GameServer.handle)
+               .outerjoin(GameServer, GameServer.game_id == Game.id)
+               .filter(Game.id >= first, Game.id <= last)
+               .order_by(Game.id))]
+    with lock:
+        recent.extend(new)
+        callbacks = list(subscribers)
+    for callback in callbacks:
+        callback(new)
+
+
+def event(game_id, data):
+    return "id: %d\nevent: game\ndata: %s\n\n" % (game_id, data)
+
+
+class GameStreamHandler(RequestHandler):
+    """
+    Push the summaries of new games as server-sent events. Clients resume
+    after the game in the Last-Event-ID header or ?last_id=.
+    """
+
+    async def get(self):
+        last_id = self.request.headers.get("Last-Event-ID",
+                                           self.get_argument("last_id", ""))
+        last_id = int(last_id) if last_id.isdigit() else None
+        loop = IOLoop.current()
+        queue = Queue()
+
+        def publish(new):
+            loop.add_callback(queue.put, new)
+
+        with lock:
+            if last_id is None:
+                last_id = recent[-1][0] if recent else 0
+            backlog = [e for e in recent if e[0] > last_id]
+            subscribers.add(publish)
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        try:
+            new = backlog
+            while True:
+                for game_id, data in new:
+                    if game_id > last_id:
+                        self.write(event(game_id, data))
+                        last_id = game_id
+                if not new:
+                    self.write(": keepalive\n\n")
+                await self.flush()
+                try:
+                    new = await queue.get(
+                        timeout=datetime.timedelta(seconds=KEEPALIVE))
+                except gen.TimeoutError:
+                    new = []
+        except StreamClosedError:
+            pass
+        finally:
+            with lock:
+                subscribers.discard(publish)
+
+
+def application(app):
+    """
+    Return a Tornado application serving the game stream and app.
+    """
+    return Application([
+        (r"/api/stream/games", GameStreamHandler),
+        (r".*", FallbackHandler, {"fallback": WSGIContainer(app)}),
+    ])
+
+
+def start_polling(app):
+    """
+    Check for new games every STREAM_POLL seconds, on the current IOLoop.
+    """
+    def poll():
+        with app.app_context():
+            indexes.update()
+
+    PeriodicCallback(poll, app.config['STREAM_POLL'] * 1000).start()
+
+
+def setup(app):
+    global recent
+    with lock:
+        recent = deque(recent, maxlen=app.config['STREAM_BACKLOG'])
@@ -1,7 +1,14 @@
 import math
-from flask import jsonify, request, Blueprint, current_app
-from werkzeug.exceptions import NotFound
+import sys
+from bisect import bisect_right
+from flask import request, Blueprint, current_app, g
+from werkzeug.exceptions import (BadRequest, HTTPException,
+                                 InternalServerError, NotFound)
 from ..database import models, extmodels
+from ..database.modelutils import to_pagination
+from .. import postings, rankings
+from ..fastjson import Raw, jsonify
+from ..querybudget import budget, over_budget
 
 
 # api blueprint
@@ -9,6 +16,7 @@ bp = Blueprint(__name__, __name__, url_prefix='/api')
 
 
 @bp.route("/config")
+@budget(5)
 def api_config():
     """
     Return configuration information.
@@ -24,6 +32,7 @@ def api_config():
 
 
 @bp.route("/count/games")
+@budget(5)
 def api_count_games():
     """
     The /count/ functions return rows and pages for the lists.
@@ -38,6 +47,7 @@ def api_count_games():
 
 
 @bp.route("/count/players")
+@budget(5)
 def api_count_players():
     rowcount = extmodels.Player.count()
     return jsonify({
@@ -48,9 +58,10 @@ def api_count_players():
 
 
 @bp.route("/count/player:games/<string:handle>")
+@budget(10)
 def api_count_player_games(handle):
     player = extmodels.Player.get_or_404(handle)
-    rowcount = len(player.game_ids)
+    rowcount = player.games_count()
     return jsonify({
         "rows": rowcount,
         "pages": math.ceil(
@@ -59,6 +70,7 @@ def api_count_player_games(handle):
 
 
 @bp.route("/count/servers")
+@budget(5)
 def api_count_servers():
     rowcount = extmodels.Server.count()
     return jsonify({
@@ -69,9 +81,10 @@ def api_count_servers():
 
 
 @bp.route("/count/server:games/<string:handle>")
+@budget(10)
 def api_count_server_games(handle):
     server = extmodels.Server.get_or_404(handle)
-    rowcount = len(server.game_ids)
+    rowcount = server.games_count()
     return jsonify({
         "rows": rowcount,
         "pages": math.ceil(
@@ -80,6 +93,7 @@ def api_count_server_games(handle):
 
 
 @bp.route("/count/maps")
+@budget(5)
 def api_count_maps():
     rowcount = extmodels.Map.count()
     return jsonify({
@@ -90,9 +104,10 @@ def api_count_maps():
 
 
 @bp.route("/count/map:games/<string:name>")
+@budget(10)
 def api_count_map_games(name):
     map_ = extmodels.Map.get_or_404(name)
-    rowcount = len(map_.game_ids)
+    rowcount = map_.games_count()
     return jsonify({
         "rows": rowcount,
         "pages": math.ceil(
@@ -100,43 +115,86 @@ def api_count_map_games(name):
     })
 
 
+def game_selection():
+    """
+    Return the parts of the games selected by the comma separated ?fields=
+    and ?expand= arguments, see extmodels.GameBundle.selection.
+    """
+
+    names = {}
+    for arg in ["fields", "expand"]:
+        value = request.args.get(arg)
+        names[arg] = None if value is None else {
+            n.strip() for n in value.split(",") if n.strip()}
+    for name in names["fields"] or []:
+        if name.partition(".")[0] not in (extmodels.GameBundle.columns +
+                                          list(extmodels.GameBundle.parts)):
+            raise BadRequest("Unknown field %s." % name)
+    for name in names["expand"] or []:
+        if name not in extmodels.GameBundle.parts:
+            raise BadRequest("Unknown part %s." % name)
+    return extmodels.GameBundle.selection(names["fields"], names["expand"])
+
+
+def encoded_games(ids):
+    """
+    Return the encoded games with ids in order, with only the parts selected
+    by the request and only their tables loaded.
+    """
+
+    selection = game_selection()
+    games = extmodels.GameBundle.get_many(
+        list(ids), extmodels.GameBundle.models(selection))
+    return [games[gameid].to_json(selection) for gameid in ids]
+
+
+def game_ids_page(ids):
+    """
+    Return the ?page= of ids, 404 if it is out of range.
+    """
+
+    return to_pagination(
+        request.args.get("page", default=1, type=int),
+        current_app.config['API_RESULTS_PER_PAGE'],
+        lambda page, per_page: extmodels.page_ids(ids, page, per_page),
+        lambda: len(ids)).items
+
+
 @bp.route("/games")
+@budget(15)
 def api_games():
     """
     Return a list of games.
     """
 
-    # Get a list of games sorted by id and offset by the page.
-    games = models.Game.query.order_by(models.Game.id).paginate(
-        request.args.get("page", default=1, type=int),
-        current_app.config['API_RESULTS_PER_PAGE']).items
-
-    # Return the list via json.
-    ret = []
-    for game in games:
-        ret.append(game.to_dict())
-    resp = jsonify({"games": ret})
+    # Get a page of games sorted by id.
+    resp = jsonify({"games": encoded_games(game_ids_page(postings.games))})
     return resp
 
 
+@bp.route("/games/<int:gameid>")
 @bp.route("/api/games/<int:gameid>")
+@budget(15)
 def api_game(gameid):
     """
     Return a single game.
     """
 
-    game = models.Game.query.filter_by(id=gameid).first_or_404()
-    resp = jsonify(game.to_dict())
+    selection = game_selection()
+    game = extmodels.GameBundle.get_or_404(
+        gameid, extmodels.GameBundle.models(selection))
+    resp = jsonify(game.to_json(selection))
     return resp
 
 
 @bp.route("/game:weapons/<int:gameid>")
+@budget(15)
 def api_game_weapons(gameid):
     """
     Return a single games's weapons.
     """
 
-    game = models.Game.query.filter_by(id=gameid).first_or_404()
+    game = extmodels.GameBundle.get_or_404(gameid)
 
     ret = {}
     weapons = game.full_weapons()
@@ -148,7 +206,118 @@ def api_game_weapons(gameid):
     return resp
 
 
+@bp.route("/changes")
+@budget(15)
+def api_changes():
+    """
+    Return the next games added after ?since_id=, in id order, with the
+    players, servers, maps, modes and mutators they changed.
+    """
+
+    since_id = request.args.get("since_id", default=0, type=int)
+    per_page = current_app.config['API_RESULTS_PER_PAGE']
+    start = bisect_right(postings.games, since_id)
+    ids = list(postings.games[start:start + per_page])
+    bundles = extmodels.GameBundle.get_many(ids)
+    changed = {kind: set() for kind in
+               ["players", "servers", "maps", "modes", "mutators"]}
+    games = []
+    for gameid in ids:
+        game = bundles[gameid]
+        games.append(game.to_json())
+        changed["players"].update(p.handle for p in game.players if p.handle)
+        if game.server is not None and game.server.handle:
+            changed["servers"].add(game.server.handle)
+        changed["maps"].add(game.map)
+        mode, mutators = postings.mode_keys(gameid, game.game.mode,
+                                            game.game.mutators)
+        if mode is not None:
+            changed["modes"].add(mode)
+        changed["mutators"].update(mutators)
+    return jsonify({
+        "games": games,
+        "changed": {kind: sorted(keys) for kind, keys in changed.items()},
+        "last_id": ids[-1] if ids else since_id,
+        "more": start + per_page < len(postings.games),
+    })
+
+
+def batch_part(path, endpoint, values):
+    # Return the response of path within the batch request.
+    with current_app.test_request_context(path, base_url=request.url_root):
+        start = g.get('budget_queries')
+        try:
+            response = current_app.make_response(
+                current_app.view_functions[endpoint](**values))
+            if start is not None:
+                error = over_budget(path, endpoint,
+                                    g.budget_queries - start)
+                if error is not None:
+                    raise error
+        except HTTPException as e:
+            return {"path": path, "status": e.code, "error": e.description}
+        except Exception:
+            # Fail only this part, as the server would fail the request.
+            current_app.log_exception(sys.exc_info())
+            e = InternalServerError()
+            return {"path": path, "status": e.code, "error": e.description}
+    return {
+        "path": path,
+        "status": response.status_code,
+        # Splice the body in instead of decoding it.
+        "body": (Raw(response.get_data().strip()) if response.is_json
+                 else response.get_data(as_text=True)),
+    }
+
+
+# Each part is held to the budget of its own view instead.
+@bp.route("/batch", methods=["GET", "POST"])
+def api_batch():
+    """
+    Return the responses of up to API_BATCH_LIMIT API paths, given as ?path=
+    arguments or a posted JSON list, in order. They share the players,
+    servers and maps they look up, and their games are loaded together.
+    """
+
+    if request.method == "POST":
+        paths = request.get_json(force=True, silent=True)
+        if not isinstance(paths, list) or not all(
+                isinstance(path, str) for path in paths):
+            raise BadRequest("Post a JSON list of paths.")
+    else:
+        paths = request.args.getlist("path")
+    if len(paths) > current_app.config['API_BATCH_LIMIT']:
+        raise BadRequest("At most %d paths can be batched." %
+                         current_app.config['API_BATCH_LIMIT'])
+
+    # Match every path first, to load the games of all of them together.
+    adapter = current_app.url_map.bind_to_environ(request.environ)
+    parts = []
+    for path in paths:
+        try:
+            endpoint, values = adapter.match(path.partition("?")[0], "GET")
+            if (not endpoint.startswith(bp.name + ".") or
+                    endpoint == request.endpoint):
+                raise NotFound
+            parts.append((path, endpoint, values))
+        except HTTPException as e:
+            parts.append((path, None, e))
+    extmodels.GameBundle.get_many(
+        [values["gameid"] for path, endpoint, values in parts
+         if endpoint is not None and "gameid" in values])
+
+    ret = []
+    for path, endpoint, values in parts:
+        if endpoint is None:
+            ret.append({"path": path, "status": values.code,
+                        "error": values.description})
+        else:
+            ret.append(batch_part(path, endpoint, values))
+    return jsonify(responses=ret)
+
+
 @bp.route("/players")
+@budget(10)
 def api_players():
     """
     Return a list of players.
@@ -168,6 +337,7 @@ def api_players():
 
 
 @bp.route("/players/<string:handle>")
+@budget(10)
 def api_player(handle):
     """
     Return a single player.
@@ -179,6 +349,7 @@ def api_player(handle):
 
 
 @bp.route("/player:games/<string:handle>")
+@budget(15)
 def api_player_games(handle):
     """
     Return a single player's games.
@@ -186,16 +357,13 @@ def api_player_games(handle):
 
     player = extmodels.Player.get_or_404(handle)
 
-    resp = jsonify(games=[
-        g.to_dict() for g in player.games_paginate(
-            request.args.get("page", default=1, type=int),
-            current_app.config['API_RESULTS_PER_PAGE']).items
-    ])
+    resp = jsonify(games=encoded_games(game_ids_page(player.game_ids)))
 
     return resp
 
 
 @bp.route("/player:weapons/<string:handle>")
+@budget(25)
 def api_player_weapons(handle):
     """
     Return a single player's weapons.
@@ -214,6 +382,7 @@ def api_player_weapons(handle):
 
 
 @bp.route("/player:game:weapons/<string:handle>/<int:gameid>")
+@budget(20)
 def api_game_player_weapons(handle, gameid):
     """
     Return a single game player's weapons.
@@ -235,6 +404,7 @@ def api_game_player_weapons(handle, gameid):
 
 @bp.route(
     "/player:game:weapons/<string:handle>/<int:gameid>/<string:weapon>")
+@budget(5)
 def api_game_player_weapon(handle, gameid, weapon):
     """
     Return a single game player's weapons.
@@ -254,6 +424,7 @@ def api_game_player_weapon(handle, gameid, weapon):
 
 
 @bp.route("/servers")
+@budget(5)
 def api_servers():
     """
     Return a list of servers.
@@ -276,6 +447,7 @@ def api_servers():
 
 
 @bp.route("/servers/<string:handle>")
+@budget(10)
 def api_server(handle):
     """
     Return a single server.
@@ -288,6 +460,7 @@ def api_server(handle):
 
 
 @bp.route("/server:games/<string:handle>")
+@budget(15)
 def api_server_games(handle):
     """
     Return a single server's games.
@@ -295,17 +468,13 @@ def api_server_games(handle):
 
     server = extmodels.Server.get_or_404(handle)
 
-    resp = jsonify(games=[
-        g.to_dict() for g in
-        server.games_paginate(
-            request.args.get("page", default=1, type=int),
-            current_app.config['API_RESULTS_PER_PAGE']).items
-    ])
+    resp = jsonify(games=encoded_games(game_ids_page(server.game_ids)))
 
     return resp
 
 
 @bp.route("/maps")
+@budget(5)
 def api_maps():
     """
     Return a list of maps.
@@ -328,6 +497,7 @@ def api_maps():
 
 
 @bp.route("/maps/<string:name>")
+@budget(10)
 def api_map(name):
     """
     Return a single map.
@@ -339,6 +509,7 @@ def api_map(name):
 
 
 @bp.route("/map:games/<string:name>")
+@budget(20)
 def api_map_games(name):
     """
     Return a single map's games.
@@ -346,19 +517,83 @@ def api_map_games(name):
 
     map_ = extmodels.Map.get_or_404(name)
 
-    resp = jsonify(
-        {
-            "games": [g.to_dict() for g in map_.games_paginate(
-                request.args.get("page", default=1, type=int),
-                current_app.config['API_RESULTS_PER_PAGE']).items
-            ]
-        }
-    )
+    resp = jsonify({"games": encoded_games(game_ids_page(map_.game_ids))})
 
     return resp
 
 
+@bp.route("/map:race/<string:name>/<string:handle>")
+@budget(10)
+def api_map_race(name, handle):
+    """
+    Return a handle's best race times on a map, with their ranks.
+    """
+
+    map_ = extmodels.Map.get_or_404(name)
+
+    return jsonify({
+        "race": map_.best_race(handle),
+        "endurance": map_.best_race(handle, True),
+    })
+
+
+@bp.route("/search/games")
+@budget(5)
+def api_search_games():
+    """
+    Return the ids of the games matching all player, server, map, mode,
+    mutator and version arguments, between the since and until times,
+    newest first.
+    """
+
+    ids = postings.search(postings.search_filters(request.args),
+                          request.args.get("since", type=int),
+                          request.args.get("until", type=int))
+    per_page = current_app.config['API_RESULTS_PER_PAGE']
+    page = max(request.args.get("page", default=1, type=int), 1)
+    return jsonify({
+        "game_ids": list(reversed(extmodels.page_ids(
+            ids, page - 1, per_page, newest_first=True))),
+        "rows": len(ids),
+        "pages": math.ceil(len(ids) / per_page),
+    })
+
+
+@bp.route("/rankings/<string:name>")
+@budget(40)
+def api_ranking(name):
+    """
+    Return the first ?limit= entries of a ranking over the games between the
+    since and until times, or the last ?days= days, optionally only of a
+    mode and mutator.
+    """
+
+    if name not in rankings.registry:
+        raise NotFound
+    mode = request.args.get("mode") or None
+    mutator = request.args.get("mutator") or None
+    if mode is not None:
+        extmodels.Mode.get_or_404(mode)
+    if mutator is not None:
+        extmodels.Mutator.get_or_404(mutator)
+    since = request.args.get("since", type=int)
+    until = request.args.get("until", type=int)
+    if since is None and until is None:
+        since = rankings.days_ago(
+            request.args.get("days", default=7, type=float))
+    scope = rankings.window_scope(since, until, mode, mutator)
+    limit = request.args.get(
+        "limit", default=current_app.config['API_HIGHSCORE_RESULTS'],
+        type=int)
+    return jsonify({
+        "first_game": scope[0],
+        "last_game": scope[1],
+        "results": rankings.registry[name](scope)[:max(limit, 0)],
+    })
+
+
 @bp.route("/weapons")
+@budget(20)
 def api_weapons():
     ret = {}
     for weapon in extmodels.Weapon.all():
@@ -368,6 +603,7 @@ def api_weapons():
 
 
 @bp.route("/weapons/<string:name>")
+@budget(5)
 def api_weapon(name):
     weapon = extmodels.Weapon.get_or_404(name)
     resp = jsonify(weapon.to_dict())
@@ -375,6 +611,7 @@ def api_weapon(name):
 
 
 @bp.route("/modes")
+@budget(5)
 def api_modes():
     ret = {}
     for mode in extmodels.Mode.all():
@@ -383,12 +620,22 @@ def api_modes():
 
 
 @bp.route("/modes/<string:name>")
+@budget(5)
 def api_mode(name):
+    """
+    Return a single mode with a page of its game ids.
+    """
+
     mode = extmodels.Mode.get_or_404(name)
-    return jsonify(mode.to_dict())
+    per_page = current_app.config['API_RESULTS_PER_PAGE']
+    page = max(request.args.get("page", default=1, type=int), 1)
+    ret = mode.to_dict(page - 1, per_page)
+    ret["pages"] = math.ceil(mode.games_count() / per_page)
+    return jsonify(ret)
 
 
 @bp.route("/mutators")
+@budget(5)
 def api_mutators():
     ret = {}
     for mutator in extmodels.Mutator.all():
@@ -397,6 +644,15 @@ def api_mutators():
 
 
 @bp.route("/mutators/<string:name>")
+@budget(5)
 def api_mutator(name):
+    """
+    Return a single mutator with a page of its game ids.
+    """
+
     mutator = extmodels.Mutator.get_or_404(name)
-    return jsonify(mutator.to_dict())
+    per_page = current_app.config['API_RESULTS_PER_PAGE']
+    page = max(request.args.get("page", default=1, type=int), 1)
+    ret = mutator.to_dict(page - 1, per_page)
+    ret["pages"] = math.ceil(mutator.games_count() / per_page)
+    return jsonify(ret)
@@ -1,12 +1,15 @@
+import calendar
+import itertools
 import time
-
 from flask import current_app
 from flask import Blueprint, render_template, send_from_directory, request
 
 from ..database import models, extmodels
 from ..database.core import db
+from ..database.modelutils import to_pagination
 from . import templateutils
-from .. import rankings
+from .. import activity, postings, rankings
+from ..querybudget import budget
 
 # displays blueprint
 bp = Blueprint(__name__, __name__)
@@ -18,19 +21,25 @@ def static(path):
 
 
 @bp.route("/")
+@budget(50)
 def display_dashboard():
-    games = models.Game.query.order_by(models.Game.id.desc()).limit(
-        current_app.config['DISPLAY_RESULTS_RECENT']).all()
+    games = extmodels.games_by_id(extmodels.page_ids(
+        postings.games, 0, current_app.config['DISPLAY_RESULTS_RECENT'],
+        True), True)
     return render_template('displays/dashboard.html',
                            games=games,
                            rankings=rankings)
 
 
 @bp.route("/games")
+@budget(10)
 def display_games():
-    pager = models.Game.query.order_by(models.Game.id.desc()).paginate(
-            request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+    pager = to_pagination(
+        request.args.get("page", default=1, type=int),
+        current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+        lambda page, pagesize: extmodels.games_by_id(
+            extmodels.page_ids(postings.games, page, pagesize, True), True),
+        lambda: len(postings.games))
 
     return render_template('displays/games.html', pager=pager,
                            Game=models.Game,
@@ -44,20 +53,16 @@ def display_games():
 
 @bp.route("/game/<int:gameid>")
 @bp.route("/games/<int:gameid>")
+@budget(15)
 def display_game(gameid):
-    game = models.Game.query.filter_by(id=gameid).first_or_404()
-    weapons = extmodels.Weapon.all_from_game(game.id)
+    game = extmodels.GameBundle.get_or_404(gameid)
     return render_template('displays/game.html', game=game,
-                           weapons=weapons,
-                           totalwielded=(models.GameWeapon.query
-                                         .with_entities(db.func.sum(
-                                             models.GameWeapon.timewielded))
-                                         .filter(models.GameWeapon
-                                                 .game_id == game.id)
-                                         .first()[0]))
+                           weapons=game.weapons,
+                           totalwielded=game.totalwielded or 0)
 
 
 @bp.route("/servers")
+@budget(5)
 def display_servers():
     pager = extmodels.Server.paginate(
         request.args.get("page", default=1, type=int),
@@ -69,24 +74,26 @@ def display_servers():
 
 @bp.route("/server/<string:handle>")
 @bp.route("/servers/<string:handle>")
+@budget(10)
 def display_server(handle):
     server = extmodels.Server.get_or_404(handle)
     return render_template('displays/server.html', server=server)
 
 
 @bp.route("/server:games/<string:handle>")
+@budget(10)
 def display_server_games(handle):
     server = extmodels.Server.get_or_404(handle)
-    pager = models.Game.query.filter(
-            models.Game.id.in_(server.game_ids)).order_by(
-            models.Game.id.desc()).paginate(
+    pager = server.games_paginate(
             request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            newest_first=True)
     return render_template('displays/server_games.html', server=server,
                            pager=pager)
 
 
 @bp.route("/players")
+@budget(10)
 def display_players():
     pager = extmodels.Player.paginate(
         request.args.get("page", default=1, type=int),
@@ -98,15 +105,15 @@ def display_players():
 
 @bp.route("/player/<string:handle>")
 @bp.route("/players/<string:handle>")
+@budget(30)
 def display_player(handle):
     player = extmodels.Player.get_or_404(handle)
-    games = (models.Game.query
-             .with_entities(models.Game.id)
-             .filter(~db.func.re_mode(models.Game.id, 'race'))
-             .filter(~db.func.re_mut(models.Game.id, 'insta'))
-             .filter(~db.func.re_mut(models.Game.id, 'medieval'))
-             .filter(models.Game.id.in_(player.game_ids))
-             .order_by(models.Game.id.desc()).limit(50))
+    # The last 50 games with the standard weapons.
+    games = list(itertools.islice((
+        game_id for game_id in reversed(player.game_ids)
+        if not postings.contains('mode', 'race', game_id) and
+        not postings.contains('mutator', 'insta', game_id) and
+        not postings.contains('mutator', 'medieval', game_id)), 50))
     weapons = extmodels.Weapon.all_from_player_games(handle, games)
     return render_template('displays/player.html',
                            player=player,
@@ -123,18 +130,19 @@ def display_player(handle):
 
 
 @bp.route("/player:games/<string:handle>")
+@budget(10)
 def display_player_games(handle):
     player = extmodels.Player.get_or_404(handle)
-    pager = models.Game.query.filter(
-            models.Game.id.in_(player.game_ids)).order_by(
-            models.Game.id.desc()).paginate(
+    pager = player.games_paginate(
             request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            newest_first=True)
     return render_template('displays/player_games.html', player=player,
                            pager=pager)
 
 
 @bp.route("/maps")
+@budget(5)
 def display_maps():
     pager = extmodels.Map.paginate(
         request.args.get("page", default=1, type=int),
@@ -145,6 +153,7 @@ def display_maps():
 
 
 @bp.route("/racemaps")
+@budget(5)
 def display_racemaps():
     pager = extmodels.Map.paginate(
         request.args.get("page", default=1, type=int),
@@ -157,28 +166,30 @@ def display_racemaps():
 
 @bp.route("/map/<string:name>")
 @bp.route("/maps/<string:name>")
+@budget(10)
 def display_map(name):
     map = extmodels.Map.get_or_404(name)
     return render_template('displays/map.html', map=map)
 
 
 @bp.route("/map:games/<string:name>")
+@budget(10)
 def display_map_games(name):
     map = extmodels.Map.get_or_404(name)
-    pager = models.Game.query.filter(
-            models.Game.id.in_(map.game_ids)).order_by(
-            models.Game.id.desc()).paginate(
+    pager = map.games_paginate(
             request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            newest_first=True)
     return render_template('displays/map_games.html', map=map,
                            pager=pager)
 
 
 @bp.route("/modes")
+@budget(5)
 def display_modes():
     ret = render_template('displays/modes.html',
                           modes=sorted(extmodels.Mode.all(),
-                                       key=lambda m: len(m.game_ids),
+                                       key=lambda m: m.games_count(),
                                        reverse=True),
                           rankings=rankings)
     return ret
@@ -186,28 +197,30 @@ def display_modes():
 
 @bp.route("/mode/<string:name>")
 @bp.route("/modes/<string:name>")
+@budget(10)
 def display_mode(name):
     mode = extmodels.Mode.get_or_404(name)
     return render_template('displays/mode.html', mode=mode)
 
 
 @bp.route("/mode:games/<string:name>")
+@budget(10)
 def display_mode_games(name):
     mode = extmodels.Mode.get_or_404(name)
-    pager = models.Game.query.filter(
-            models.Game.id.in_(mode.game_ids)).order_by(
-            models.Game.id.desc()).paginate(
+    pager = mode.games_paginate(
             request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            newest_first=True)
     return render_template('displays/mode_games.html', mode=mode,
                            pager=pager)
 
 
 @bp.route("/mutators")
+@budget(5)
 def display_mutators():
     ret = render_template('displays/mutators.html',
                           mutators=sorted(extmodels.Mutator.all(),
-                                          key=lambda m: len(m.game_ids),
+                                          key=lambda m: m.games_count(),
                                           reverse=True),
                           rankings=rankings)
     return ret
@@ -215,24 +228,26 @@ def display_mutators():
 
 @bp.route("/mutator/<string:name>")
 @bp.route("/mutators/<string:name>")
+@budget(10)
 def display_mutator(name):
     mutator = extmodels.Mutator.get_or_404(name)
     return render_template('displays/mutator.html', mutator=mutator)
 
 
 @bp.route("/mutator:games/<string:name>")
+@budget(10)
 def display_mutator_games(name):
     mutator = extmodels.Mutator.get_or_404(name)
-    pager = models.Game.query.filter(
-            models.Game.id.in_(mutator.game_ids)).order_by(
-            models.Game.id.desc()).paginate(
+    pager = mutator.games_paginate(
             request.args.get("page", default=1, type=int),
-            current_app.config['DISPLAY_RESULTS_PER_PAGE'])
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            newest_first=True)
     return render_template('displays/mutator_games.html', mutator=mutator,
                            pager=pager)
 
 
 @bp.route("/weapons")
+@budget(20)
 def display_weapons():
     games = (models.Game.query
              .with_entities(models.Game.id)
@@ -253,106 +268,73 @@ def display_weapons():
     return ret
 
 
+def date_arg(name, end_of_day=False):
+    """
+    Return the time of the date argument name (YYYY-MM-DD, UTC), or None.
+    """
+    try:
+        t = calendar.timegm(time.strptime(request.args.get(name, ""),
+                                          "%Y-%m-%d"))
+    except ValueError:
+        return None
+    return t + 60 * 60 * 24 - 1 if end_of_day else t
+
+
+@bp.route("/search")
+@budget(15)
+def display_search():
+    filters = postings.search_filters(request.args)
+    since = date_arg("since")
+    until = date_arg("until", True)
+    kwargs = {}
+    if filters or since is not None or until is not None:
+        ids = postings.search(filters, since, until)
+        kwargs["pager"] = to_pagination(
+            request.args.get("page", default=1, type=int),
+            current_app.config['DISPLAY_RESULTS_PER_PAGE'],
+            lambda page, pagesize: extmodels.games_by_id(
+                extmodels.page_ids(ids, page, pagesize, True), True),
+            lambda: len(ids))
+    return render_template('displays/search.html',
+                           modes=extmodels.Mode.mode_list(),
+                           mutators=extmodels.Mutator.mutator_list(),
+                           versions=sorted(postings.keys('version')),
+                           **kwargs)
+
+
+def display_activity(kind, days, label):
+    """
+    Render a histogram of games, ?days= and ?tz= (UTC offset in hours)
+    change the window and the time zone.
+    """
+    days = min(max(request.args.get("days", default=days, type=int), 1), 365)
+    tz = min(max(request.args.get("tz", default=0, type=float), -12), 14)
+    utcoffset = int(tz * 60 * 60)
+    times = activity.histogram(kind, days, utcoffset,
+                               activity.window_end(kind, utcoffset))
+    return render_template('displays/times.html',
+                           days=days,
+                           label=label,
+                           timezone=("UTC%+g" % tz) if tz else "UTC",
+                           times=times)
+
+
 @bp.route("/activehours")
+@budget(5)
 def display_activehours():
-    minutes = int(templateutils.time_str(time.time(), "%M"))
-    days = (1 / 24 / 60) * (24 * 60 * 30 + minutes)
-    thishour = templateutils.time_str(time.time(), "%F %H")
-    first_game = rankings.first_game_in_days(days)
-    times = {}
-    for game in (models.Game.query
-                 .filter(models.Game.id >= first_game)):
-        hour = int(templateutils.time_str(game.time, "%H"))
-        if templateutils.time_str(game.time, "%F %H") == thishour:
-            continue
-        if hour not in times:
-            times[hour] = {
-                "players": 0
-            }
-        times[hour]["players"] += 1
-    barfactor = 100 / max([times[t]["players"] for t in times])
-    for hour in times:
-        times[hour]["hour"] = hour
-        times[hour]["label"] = hour
-        times[hour]["players"] = round(times[hour]["players"], 1)
-        times[hour]["bar"] = "|" * round(times[hour]["players"] * barfactor)
-    ret = render_template('displays/times.html',
-                          days=30,
-                          label="Hours",
-                          times=sorted(times.values(),
-                                       key=lambda k: k["hour"]))
-    return ret
+    return display_activity("hours", 30, "Hours")
 
 
 @bp.route("/activeweekdays")
+@budget(5)
 def display_activeweekdays():
-    gmtime = time.gmtime()
-    secondsleftinday = 24 * 60 * 60 - (
-        gmtime.tm_sec + gmtime.tm_min * 60 + gmtime.tm_hour * 3600)
-    days = 7 * 4 + (secondsleftinday / 24 / 60 / 60)
-    first_game = rankings.first_game_in_days(days)
-    today = templateutils.time_str(time.time(), "%F")
-    times = {}
-    for game in (models.Game.query
-                 .filter(models.Game.id >= first_game)):
-        if templateutils.time_str(game.time, "%F") == today:
-            continue
-        dayidx = int(templateutils.time_str(game.time, "%u"))
-        day = templateutils.time_str(game.time, "%a")
-        if dayidx not in times:
-            times[dayidx] = {
-                "players": 0,
-                "label": day,
-            }
-        times[dayidx]["players"] += 1
-    barfactor = 100 / max([times[t]["players"] for t in times])
-    for day in times:
-        times[day]["day"] = day
-        times[day]["players"] = round(times[day]["players"], 1)
-        times[day]["bar"] = "|" * round(times[day]["players"] * barfactor)
-    ret = render_template('displays/times.html',
-                          days=28,
-                          label="Weekdays",
-                          times=sorted(times.values(), key=lambda k: k["day"]))
-    return ret
+    return display_activity("weekdays", 28, "Weekdays")
 
 
 @bp.route("/activeweekdayhours")
+@budget(5)
 def display_activeweekdayhours():
-    gmtime = time.gmtime()
-    secondsleftinday = 24 * 60 * 60 - (
-        gmtime.tm_sec + gmtime.tm_min * 60 + gmtime.tm_hour * 3600)
-    days = 7 * 4 + (secondsleftinday / 24 / 60 / 60)
-    first_game = rankings.first_game_in_days(days)
-    today = templateutils.time_str(time.time(), "%F")
-    times = {}
-    for game in (models.Game.query
-                 .filter(models.Game.id >= first_game)):
-        if templateutils.time_str(game.time, "%F") == today:
-            continue
-        dayidx = int(templateutils.time_str(game.time, "%u"))
-        day = templateutils.time_str(game.time, "%a")
-        hour = int(templateutils.time_str(game.time, "%H"))
-        idx = (dayidx, hour)
-        if idx not in times:
-            times[idx] = {
-                "players": 0,
-                "label": "%s %d" % (day, hour),
-                "day": dayidx,
-                "hour": hour,
-            }
-        times[idx]["players"] += 1
-    barfactor = 100 / max([times[t]["players"] for t in times])
-    for idx in times:
-        times[idx]["players"] = round(times[idx]["players"], 1)
-        times[idx]["bar"] = "|" * round(times[idx]["players"] * barfactor)
-    ret = render_template('displays/times.html',
-                          days=28,
-                          label="Weekday Hours",
-                          times=sorted(sorted(times.values(),
-                                              key=lambda k: k["hour"]),
-                                       key=lambda k: k["day"]))
-    return ret
+    return display_activity("weekdayhours", 28, "Weekday Hours")
 
 
 templateutils.setup(bp)
@@ -1,4 +1,6 @@
 import time
+from flask import request
+from werkzeug.urls import url_encode
 
 
 def time_str(epoch_time, output_format="%F %T %Z"):
@@ -86,6 +88,15 @@ def sdiv(n):
     return max(1, n)
 
 
+def page_url(page):
+    """
+    Return the current URL with its page argument changed to page.
+    """
+    args = request.args.copy()
+    args["page"] = page
+    return "%s?%s" % (request.path, url_encode(args))
+
+
 def setup(bp):
-    for f in [time_str, duration_str, time_ago, sdiv]:
+    for f in [time_str, duration_str, time_ago, sdiv, page_url]:
         bp.add_app_template_filter(f)
@@ -0,0 +1,38 @@
+import unittest
+from statsdbinterface.database.extmodels import GameBundle
+from statsdbinterface.database.models import GameBombing, GamePlayer
+
+
+class SelectionTest(unittest.TestCase):
+
+    def test_everything(self):
+        selection = GameBundle.selection()
+        for name in GameBundle.columns + list(GameBundle.parts):
+            self.assertIsNone(selection[name])
+
+    def test_fields(self):
+        selection = GameBundle.selection(["id", "players.name"])
+        self.assertEqual(selection, {"id": None, "players": {"name"}})
+
+    def test_expand(self):
+        selection = GameBundle.selection(None, ["players.bombings"])
+        self.assertIn("players.bombings", selection)
+        self.assertNotIn("players.captures", selection)
+        self.assertNotIn("teams", selection)
+
+    def test_fields_and_expand(self):
+        # An expanded sub-part is included even if its part only has some
+        # fields.
+        selection = GameBundle.selection(["id", "players.name"],
+                                         ["players.bombings"])
+        self.assertEqual(selection, {
+            "id": None,
+            "players": {"name"},
+            "players.bombings": None,
+        })
+        self.assertEqual(GameBundle.models(selection),
+                         [GamePlayer, GameBombing])
+
+
+if __name__ == "__main__":
+    unittest.main()